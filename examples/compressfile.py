@@ -12,16 +12,10 @@ import wimlib
 import sys, struct, argparse
 
 def compress(in_fd, out_fd, chunk_size, compressor):
-    chunk_num = 0
-    while True:
-        in_data = in_fd.read(chunk_size)
+    # Chunks are compressed in parallel, results come back in order
+    chunks = iter(lambda: in_fd.read(chunk_size), b"")
+    for chunk_num, (in_data, out_size, out_data) in enumerate(compressor.compress(chunks)):
         in_size = len(in_data)
-
-        if not in_data:
-            # No more data to compress
-            break;
-
-        out_size, out_data = compressor.compress(in_data)
         if not out_size:
             out_data = in_data
             out_size = in_size
@@ -30,7 +24,6 @@ def compress(in_fd, out_fd, chunk_size, compressor):
         out_fd.write(struct.pack("<i", in_size))
         out_fd.write(struct.pack("<i", out_size))
         out_fd.write(out_data)
-        chunk_num += 1
 
         # All done
         # No need to free any buffers...
@@ -61,15 +54,15 @@ def main(compression_type, chunk_size, in_file, out_file):
         with open(in_file, "rb") as input_file:
             # Open output file
             with open(out_file, "wb") as output_file:
-                # Create compressor
-                compressor = wimlib.compression.Compressor(ctype, chunk_size)
-    
-                # Write compression type and chunk size to output file
-                output_file.write(struct.pack('<i', ctype))
-                output_file.write(struct.pack('<i', chunk_size))
-    
-                # Do the actual compressing
-                compress(input_file, output_file, chunk_size, compressor)
+                # Create compressor (one native compressor per worker thread)
+                with wimlib.compression.ParallelCompressor(ctype, chunk_size) as compressor:
+
+                    # Write compression type and chunk size to output file
+                    output_file.write(struct.pack('<i', ctype))
+                    output_file.write(struct.pack('<i', chunk_size))
+
+                    # Do the actual compressing
+                    compress(input_file, output_file, chunk_size, compressor)
         # No need to call wimlib_free_compressor() this will be done unpon compressor destruction.
     except Exception as ex:
         print("Error: {0}".format(ex.message))
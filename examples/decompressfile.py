@@ -11,12 +11,11 @@ from __future__ import print_function
 import wimlib
 import sys, struct, argparse
 
-def decompress(in_fd, out_fd, chunk_size, decompressor):
-    chunk_num = 0
+def read_chunks(in_fd, chunk_size):
     while True:
         in_metadata = in_fd.read(8)
         if not in_metadata:
-            # No more data to compress
+            # No more data to decompress
             break;
 
         u_size, c_size = struct.unpack("<ii", in_metadata)
@@ -24,20 +23,18 @@ def decompress(in_fd, out_fd, chunk_size, decompressor):
         if (c_size > u_size) or (u_size > chunk_size):
             raise Exception("The Data is invalid!")
 
+        in_data = in_fd.read(c_size)
+        if len(in_data) != c_size:
+            raise Exception("Expected to read {0} bytes of compressed data".format(c_size))
+        yield in_data, u_size
 
-        if u_size == c_size:
-            in_data = in_fd.read(u_size)
-            if len(in_data) != u_size:
-                raise Exception("Expected to read {0} bytes of unsomoressed data".format(u_size))
-        else:
-            in_data = in_fd.read(c_size)
-            if len(in_data) != c_size:
-                raise Exception("Expected to read {0} bytes of compressed data".format(c_size))
-            out_data = decompressor.decompress(in_data, u_size)
 
-        print("Chunk {0}: {1} => {2}".format(chunk_num, c_size, u_size)) 
+def decompress(in_fd, out_fd, chunk_size, decompressor):
+    # Chunks are decompressed in parallel, results come back in order; chunks
+    # stored uncompressed (u_size == c_size) are passed through as they are.
+    for chunk_num, out_data in enumerate(decompressor.decompress(read_chunks(in_fd, chunk_size))):
+        print("Chunk {0}: => {1}".format(chunk_num, len(out_data)))
         out_fd.write(out_data)
-        chunk_num += 1
         # All done
         # No need to free any buffers...
 
@@ -52,11 +49,11 @@ def main(compression_type, chunk_size, in_file, out_file):
             ctype, block_size = struct.unpack('<ii', input_file.read(8))
 
             with open(out_file, "wb") as output_file:
-                # Create compressor
-                decompressor = wimlib.compression.Decompressor(ctype, block_size)
-    
-                # Do the actual compressing
-                decompress(input_file, output_file, chunk_size, decompressor)
+                # Create decompressor (one native decompressor per worker thread)
+                with wimlib.compression.ParallelDecompressor(ctype, block_size) as decompressor:
+
+                    # Do the actual decompressing
+                    decompress(input_file, output_file, block_size, decompressor)
         # No need to call wimlib_free_compressor() this will be done unpon compressor destruction.
     except Exception as ex:
         raise #print("Error: {0}".format(ex.message))
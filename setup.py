@@ -1,9 +1,31 @@
+import os
+import sys
+
 from setuptools import setup
+from setuptools.command.build_ext import build_ext
+from setuptools.errors import BaseError, CCompilerError
 
 long_description = """
 
 """
 
+# The compiled (API mode) backend needs the wimlib headers and a C compiler;
+# set PYTHON_WIMLIB_NO_COMPILE=1 to install the pure python (ABI mode) package.
+cffi_modules = []
+if not os.environ.get("PYTHON_WIMLIB_NO_COMPILE"):
+        cffi_modules.append("wimlib/_build.py:ffibuilder")
+
+
+class optional_build_ext(build_ext):
+        """ Install without the compiled backend when it can't be built, wimlib then uses ABI mode """
+        def run(self):
+                try:
+                        super().run()
+                except (BaseError, CCompilerError) as ex:
+                        print(f"warning: not building the compiled wimlib backend ({ex}); "
+                              "python-wimlib will use ABI mode", file=sys.stderr)
+
+
 setup(
         name="python-wimlib",
         version="0.1.2",
@@ -18,9 +40,14 @@ setup(
                 "wimlib": "wimlib",
         },
         license="GPLv3",
+        setup_requires=[
+                "cffi>=1.8.2",
+        ],
         install_requires=[
                 "cffi>=1.8.2",
         ],
+        cffi_modules=cffi_modules,
+        cmdclass={"build_ext": optional_build_ext},
         classifiers=[
                 'Intended Audience :: Developers',
         ],
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("cffi")
+
+import wimlib
+from wimlib.image import DirTree
+
+ffi = wimlib._ffi
+
+
+def _walk(tree, entries):
+    """ Feed (full path, depth) entries to the collector of tree, like wimlib_iterate_dir_tree """
+    collect = tree._collector()
+    for full_path, depth in entries:
+        full_path = full_path.encode()
+        dentry = ffi.new("struct wimlib_dir_entry *", {"streams": 1})
+        keep = [ffi.new("char[]", full_path), ffi.new("char[]", full_path.rsplit(b"/", 1)[-1])]
+        dentry.full_path, dentry.filename = keep
+        dentry.depth = depth
+        assert collect(dentry) == 0
+    return tree
+
+
+def test_scan_from_root():
+    tree = _walk(DirTree(), [("/", 0), ("/Windows", 1), ("/Windows/INF", 2), ("/Users", 1)])
+    assert list(tree.parents) == [-1, 0, 1, 0]
+    assert tree.paths == ["/", "/Windows", "/Windows/INF", "/Users"]
+
+
+def test_scan_from_sub_path():
+    tree = _walk(DirTree(), [("/Windows", 1), ("/Windows/System32", 2), ("/Windows/INF", 2),
+                             ("/Windows/INF/a.inf", 3)])
+    assert list(tree.parents) == [-1, 0, 0, 2]
+    assert tree.paths == ["/Windows", "/Windows/System32", "/Windows/INF", "/Windows/INF/a.inf"]
+    assert tree.path(3) == "/Windows/INF/a.inf"
+
+
+def test_scan_children():
+    tree = _walk(DirTree(), [("/Windows/System32", 2), ("/Windows/INF", 2), ("/Windows/explorer.exe", 2)])
+    assert list(tree.parents) == [-1, -1, -1]
+    assert tree.paths == ["/Windows/System32", "/Windows/INF", "/Windows/explorer.exe"]
@@ -0,0 +1,46 @@
+import types
+
+import pytest
+
+pytest.importorskip("cffi")
+
+from wimlib import WimException
+from wimlib.file import WimFile
+from wimlib.image import Image
+
+
+def _wim(path, sizes):
+    """ WimFile stand-in over images of the given sizes, opened again by every worker """
+    wim = WimFile.__new__(WimFile)
+    wim.path = str(path)
+    wim.images = {index: types.SimpleNamespace(size=size) for index, size in sizes.items()}
+    return wim
+
+
+def _image(index):
+    image = Image.__new__(Image)
+    image.index = index
+    return image
+
+
+def test_extract_many(monkeypatch, tmp_path):
+    wim = _wim(tmp_path / "a.wim", {1: 10, 2: 30, 3: 20})
+    opened = types.SimpleNamespace(images={index: _image(index) for index in wim.images})
+    monkeypatch.setattr(WimFile, "from_file", staticmethod(lambda path: opened))
+    extracted = []
+
+    def extract(self, target, flags=0):
+        if self.index == 3:
+            raise WimException("bad image")
+        extracted.append((self.index, target, flags))
+
+    monkeypatch.setattr(Image, "extract", extract)
+    jobs = [(1, tmp_path / "one", 0), (2, bytes(tmp_path / "two"), 4), (3, str(tmp_path / "three"), 0)]
+    results = wim.extract_many(jobs, workers=1, raise_errors=False)
+
+    # Targets keep their str / bytes type, and the largest image goes first
+    assert extracted == [(2, bytes(tmp_path / "two"), 4), (1, str(tmp_path / "one"), 0)]
+    assert [result.image for result in results] == [1, 2, 3]
+    assert results[0].error is None and isinstance(results[2].error, WimException)
+    with pytest.raises(WimException):
+        wim.extract_many(jobs, workers=2)
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("cffi")
+
+from wimlib.image import _drop_nested, _normalize_wim_path
+
+
+def test_drop_nested_with_siblings_sorting_in_between():
+    assert _drop_nested(["/Windows", "/Windows.old", "/Windows/INF/x.inf"]) == ["/Windows", "/Windows.old"]
+    assert _drop_nested(["/a", "/a b", "/a-b/c", "/a/c"]) == ["/a", "/a b", "/a-b/c"]
+
+
+def test_drop_nested_root():
+    assert _drop_nested(["/Windows", "/"]) == ["/"]
+
+
+def test_normalize_wim_path():
+    assert _normalize_wim_path("Windows\\\\INF\\") == "/Windows/INF"
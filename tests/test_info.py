@@ -0,0 +1,24 @@
+from wimlib import info
+from wimlib.info import WimXml
+
+XML = """<WIM><TOTALBYTES>4096</TOTALBYTES>
+<IMAGE INDEX="1"><NAME>Windows 10 Pro</NAME><DESCRIPTION> Pro </DESCRIPTION>
+<WINDOWS><VERSION><MAJOR>10</MAJOR><BUILD>19041</BUILD></VERSION>
+<LANGUAGES><LANGUAGE>en-US</LANGUAGE><LANGUAGE>fr-FR</LANGUAGE></LANGUAGES></WINDOWS></IMAGE>
+<IMAGE INDEX="2"><NAME>Windows 10 Home</NAME><FLAGS></FLAGS></IMAGE>
+</WIM>"""
+
+
+def test_parse_utf16_with_bom():
+    xml = WimXml.parse(b"\xff\xfe" + XML.encode("utf-16-le"))
+    assert xml.properties == {"TOTALBYTES": "4096"}
+    assert xml.images[1] == {
+        "NAME": "Windows 10 Pro", "DESCRIPTION": "Pro", "WINDOWS/VERSION/MAJOR": "10",
+        "WINDOWS/VERSION/BUILD": "19041", "WINDOWS/LANGUAGES/LANGUAGE": "en-US",
+        "WINDOWS/LANGUAGES/LANGUAGE[2]": "fr-FR"}
+    assert xml.images[2] == {"NAME": "Windows 10 Home", "FLAGS": ""}
+
+
+def test_parse_in_pieces(monkeypatch):
+    monkeypatch.setattr(info, "_XML_FEED_SIZE", 7)
+    assert WimXml.parse(XML.encode()).images == WimXml.parse(XML).images
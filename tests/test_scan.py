@@ -0,0 +1,80 @@
+import uuid
+
+import pytest
+
+from wimlib import scan
+
+HEADER_SIZE = 208
+GUID = uuid.UUID("0123456789abcdef0123456789abcdef")
+XML = ('<WIM><TOTALBYTES>1234</TOTALBYTES><IMAGE INDEX="1"><NAME>Base</NAME><TOTALBYTES>1000</TOTALBYTES></IMAGE>'
+       '<IMAGE INDEX="2"><NAME>Full</NAME><DESCRIPTION>All</DESCRIPTION></IMAGE></WIM>')
+
+
+def _reshdr(stored_size, offset, size, flags=0):
+    return scan._RESHDR.pack(stored_size | flags << 56, offset, size)
+
+
+def _write_wim(path, flags=scan.HDR_FLAG_COMPRESSION | scan.HDR_FLAG_COMPRESS_LZX, xml_flags=0,
+               magic=scan.WIM_MAGIC):
+    xml_data = b"\xff\xfe" + XML.encode("utf-16-le")
+    header = scan._HEADER.pack(magic, HEADER_SIZE, 0x10d00, flags, 32768, GUID.bytes, 1, 1, 2,
+                               _reshdr(0, 0, 0), _reshdr(len(xml_data), HEADER_SIZE, len(xml_data), xml_flags),
+                               _reshdr(0, 0, 0), 2)
+    # Then the integrity table resource header and unused bytes
+    path.write_bytes(header.ljust(HEADER_SIZE, b"\0") + xml_data)
+    return str(path)
+
+
+def test_header_layout():
+    # The fields read end with the boot index at offset 120 of the 208 byte header;
+    # resource headers are 24 bytes, the XML data one at offset 72
+    assert scan._HEADER.size == 124
+    assert scan._RESHDR.size == 24
+    data = scan._HEADER.pack(scan.WIM_MAGIC, HEADER_SIZE, 0, 0, 0, GUID.bytes, 0, 0, 0,
+                             b"\0" * 24, b"\1" * 24, b"\0" * 24, 0x02020202)
+    assert data[24:40] == GUID.bytes
+    assert data[72:96] == b"\1" * 24
+    assert data[120:124] == b"\2" * 4
+
+
+def test_read_header(tmp_path):
+    with open(_write_wim(tmp_path / "a.wim"), "rb") as wim_file:
+        fields, xml_data = scan._read_header(wim_file)
+    assert fields == {"guid": str(GUID), "wim_version": 0x10d00, "compression_type": 2, "chunk_size": 32768,
+                      "part_number": 1, "total_parts": 1, "boot_index": 2, "image_count": 2}
+    assert xml_data.decode("utf-16") == XML
+
+
+@pytest.mark.parametrize("flags, compression_type", [
+    (0, 0),
+    (scan.HDR_FLAG_COMPRESSION | scan.HDR_FLAG_COMPRESS_XPRESS, 1),
+    (scan.HDR_FLAG_COMPRESSION | scan.HDR_FLAG_COMPRESS_LZMS, 3),
+])
+def test_read_header_compression(tmp_path, flags, compression_type):
+    with open(_write_wim(tmp_path / "a.wim", flags), "rb") as wim_file:
+        assert scan._read_header(wim_file)[0]["compression_type"] == compression_type
+
+
+def test_read_header_errors(tmp_path):
+    for path, message in ((_write_wim(tmp_path / "c.wim", xml_flags=scan.RESHDR_FLAG_COMPRESSED), "Compressed"),
+                          (_write_wim(tmp_path / "p.wim", magic=scan.PIPABLE_WIM_MAGIC), "Pipable")):
+        with open(path, "rb") as wim_file, pytest.raises(scan.HeaderError, match=message):
+            scan._read_header(wim_file)
+    truncated = tmp_path / "t.wim"
+    truncated.write_bytes(open(_write_wim(tmp_path / "a.wim"), "rb").read()[:-10])
+    with open(truncated, "rb") as wim_file, pytest.raises(scan.HeaderError, match="Truncated"):
+        scan._read_header(wim_file)
+
+
+def test_read_guid(tmp_path):
+    assert scan.read_guid(_write_wim(tmp_path / "p.wim", magic=scan.PIPABLE_WIM_MAGIC)) == str(GUID)
+
+
+def test_scan_many_with_cache(tmp_path):
+    path = _write_wim(tmp_path / "a.wim")
+    cache = str(tmp_path / "scan.db")
+    record, = scan.scan_many([path], workers=1, cache=cache)
+    assert record.error is None
+    assert (record.guid, record.image_count, record.total_bytes) == (str(GUID), 2, 1234)
+    assert record.images == (scan.ImageRecord(1, "Base", "", 1000), scan.ImageRecord(2, "Full", "All", None))
+    assert list(scan.scan_many([path], workers=1, cache=cache)) == [record]
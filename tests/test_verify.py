@@ -0,0 +1,40 @@
+import time
+
+from wimlib.verify import BandwidthBudget, VerifyReport, VerifyResult
+
+
+class _Clock(object):
+    """ time.monotonic / time.sleep stand-ins, sleeping advances the clock """
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+
+def test_bandwidth_budget(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(time, "sleep", clock.sleep)
+    budget = BandwidthBudget(1000)
+    budget.consume(500)
+    budget.consume(500)
+    assert clock.slept == [0.5, 0.5]
+    # Idle time is not saved up for a later burst
+    clock.now += 10
+    budget.consume(2000)
+    assert clock.slept[-1] == 2.0
+
+
+def test_report_totals():
+    results = [VerifyResult("a", "ok", None, 10, 1, 4000, 2, 2.0, 0.002, 0.0),
+               VerifyResult("b", "failed", "WimException: bad", 10, 1, 1000, 1, 1.0, 0.001, 0.0),
+               VerifyResult("c", "skipped", None, None, None, None, None, None, None, 0.0)]
+    report = VerifyReport(results, 2.0).as_dict()
+    assert (report["files"], report["verified"], report["failed"], report["skipped"]) == (3, 2, 1, 1)
+    assert report["bytes"] == 5000
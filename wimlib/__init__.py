@@ -1,10 +1,23 @@
 import atexit
-from wimlib.backend import WimBackend
+import importlib
+import threading
 
 __version__ = "0.1.2"
-_backend = WimBackend()
-_lib = _backend.lib
-_ffi = _backend.ffi
+
+# The backend (_backend, _lib and _ffi) and the submodules are loaded lazily
+# through the module __getattr__ below, so a plain "import wimlib" neither
+# imports cffi nor loads libwim. Only the package itself is lazy: the modules
+# wrapping libwim functions (compression, file, image and the ones importing
+# them) take _lib and _ffi at import, so importing them loads the backend.
+_BACKEND_ATTRS = ("_backend", "_lib", "_ffi")
+_SUBMODULES = ("aio", "blob", "compression", "errors", "file", "image", "index", "info", "pipe", "progress", "scan", "tuning", "verify")
+# Package level functions defined in a submodule: name -> submodule
+_LAZY_FUNCTIONS = {
+    "extract_from_stream": "image",
+    "scan_many": "scan",
+    "verify_many": "verify",
+}
+_backend_lock = threading.Lock()
 
 # Init flags for wimlib_global_init
 INIT_FLAG_DONT_ACQUIRE_PRIVILEGES = 0x00000002  # Windows only
@@ -18,18 +31,41 @@ INIT_FLAG_DEFAULT_CASE_INSENSITIVE = 0x00000020
 _use_executable_mount = False
 
 
+def _get_backend():
+    """ Create the backend on first use. For internal use. """
+    if "_backend" not in globals():
+        with _backend_lock:
+            if "_backend" not in globals():
+                from wimlib.backend import WimBackend
+                backend = WimBackend()
+                globals().update(_lib=backend.lib, _ffi=backend.ffi, _backend=backend)
+                initialize()
+    return globals()["_backend"]
+
+
+def __getattr__(name):
+    if name in _BACKEND_ATTRS:
+        _get_backend()
+        return globals()[name]
+    if name in _SUBMODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name in _LAZY_FUNCTIONS:
+        return getattr(importlib.import_module(f"{__name__}.{_LAZY_FUNCTIONS[name]}"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def initialize(init_flags=0):
     atexit.register(shutdown)
 
 
 def shutdown():
     """ Cleanup function for wimlib, call is optional. """
-    _lib.wimlib_global_cleanup()
+    _get_backend().lib.wimlib_global_cleanup()
 
 
 def wimlib_version():
     """ Get wimlib version number as tuple of (MAJOR, MINOR, PATCH) """
-    ver = _lib.wimlib_get_version()
+    ver = _get_backend().lib.wimlib_get_version()
     return (ver >> 20, (ver >> 10) & 0x3ff, ver & 0x3ff)
 
 
@@ -43,22 +79,23 @@ class WimException(Exception):
 
 
 def get_error_string(error_num):
-    return _ffi.string(_lib.wimlib_get_error_string(error_num))
+    backend = _get_backend()
+    return backend.ffi.string(backend.lib.wimlib_get_error_string(error_num))
 
 
 def global_init(init_flags=0):
     """ Initialization for wimlib; called with flags=0 when any other function is invoked"""
-    if (ret := _lib.wimlib_global_init(flags)):
+    if (ret := _get_backend().lib.wimlib_global_init(init_flags)):
         raise WimException(ret)
 
 
 def set_error_printing(state):
-    if (ret := _lib.wimlib_set_print_errors(bool(state))):
+    if (ret := _get_backend().lib.wimlib_set_print_errors(bool(state))):
         raise WimException(ret)
 
 
 def set_error_file_by_name(file_path):
-    if (ret := _lib.wimlib_set_error_file_by_name(file_path)):
+    if (ret := _get_backend().lib.wimlib_set_error_file_by_name(file_path)):
         raise WimException(ret)
 
 
@@ -76,6 +113,3 @@ def join_with_progress():
 
 def set_memory_allocator():
     raise NotImplementedError()
-
-
-initialize()
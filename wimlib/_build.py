@@ -0,0 +1,27 @@
+"""
+cffi build script for the compiled (API mode) wimlib backend.
+
+Used by setup.py through ``cffi_modules``; it can also be run directly with
+``python wimlib/_build.py`` to build the extension module in place. When the
+resulting ``wimlib._wimlib_cffi`` module is not available, WimBackend falls
+back to parsing the C definitions at runtime and using ABI mode.
+"""
+import os
+import platform
+import runpy
+
+import cffi
+
+# Load c_defs.py by path; importing the wimlib package here would try to
+# load the backend we are about to build.
+_c_defs = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "c_defs.py"))
+
+ffibuilder = cffi.FFI()
+ffibuilder.cdef(_c_defs["get_platform_cdefs"](platform.system()))
+ffibuilder.cdef(_c_defs["WIMLIB_DEFAULT_CDEFS"])
+ffibuilder.cdef(_c_defs["get_callback_cdefs"]())
+ffibuilder.set_source("wimlib._wimlib_cffi", "#include <wimlib.h>", libraries=["wim"])
+
+
+if __name__ == "__main__":
+    ffibuilder.compile(tmpdir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,142 @@
+"""
+asyncio support for the long running wimlib operations.
+
+The libwim calls run on a dedicated thread pool (cffi releases the GIL while
+they run), so the event loop keeps running:
+
+    op = wimlib.aio.write(wim)
+    async for event in op:
+        print(event.completed_bytes, event.total_bytes)
+    await op
+
+Cancelling the awaiting task aborts the libwim call by returning
+PROGRESS_STATUS_ABORT from its progress callback.
+"""
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from wimlib.progress import PROGRESS_STATUS_ABORT, PROGRESS_STATUS_CONTINUE, ProgressDispatcher
+
+# Progress events per second and message type delivered to async iterators
+DEFAULT_MAX_RATE = 20
+
+_executor = None
+_executor_lock = threading.Lock()
+# A WIMStruct must not be used by two threads at once
+_wim_locks = weakref.WeakKeyDictionary()
+
+
+def get_executor():
+    """ Get the executor the operations run on, created on first use """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="wimlib-aio")
+        return _executor
+
+
+def set_executor(executor):
+    """ Run the operations on executor instead of the default thread pool """
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+def _wim_lock(wim):
+    with _executor_lock:
+        return _wim_locks.setdefault(wim, threading.Lock())
+
+
+class Operation(object):
+    """
+    A libwim call running on the aio executor.
+
+    Await it for the result, or iterate over it with "async for" to receive its
+    progress events (detached ProgressEvent objects) until it finishes; then
+    await it to get the result or the error. Cancelling a task awaiting or
+    iterating it aborts the call.
+    """
+    def __init__(self, wim, func, *args, max_rate=DEFAULT_MAX_RATE):
+        self._loop = asyncio.get_running_loop()
+        self._events = asyncio.Queue()
+        self._aborted = threading.Event()
+        self._wim = wim
+        self._max_rate = max_rate
+        self._future = self._loop.run_in_executor(get_executor(), self._run, func, args)
+        # Don't warn about an unretrieved error of an aborted operation
+        self._future.add_done_callback(lambda future: future.cancelled() or future.exception())
+
+    def _run(self, func, args):
+        dispatcher = ProgressDispatcher(self._on_progress, max_rate=self._max_rate)
+        try:
+            with _wim_lock(self._wim), self._wim._temporary_progress(dispatcher):
+                return func(*args)
+        finally:
+            # An error of _on_progress (func then raises the abort's WimException)
+            dispatcher.raise_pending()
+
+    def _on_progress(self, event, context):
+        if self._aborted.is_set():
+            return PROGRESS_STATUS_ABORT
+        self._loop.call_soon_threadsafe(self._events.put_nowait, event.detach())
+        return PROGRESS_STATUS_CONTINUE
+
+    def abort(self):
+        """ Ask libwim to stop the operation at its next progress message """
+        self._aborted.set()
+
+    def done(self):
+        return self._future.done()
+
+    async def _wait(self):
+        try:
+            return await asyncio.shield(self._future)
+        except asyncio.CancelledError:
+            self.abort()
+            raise
+
+    def __await__(self):
+        return self._wait().__await__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._events.empty() and self._future.done():
+            raise StopAsyncIteration
+        get = asyncio.ensure_future(self._events.get())
+        try:
+            await asyncio.wait((get, self._future), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            get.cancel()
+            self.abort()
+            raise
+        if get.done():
+            return get.result()
+        get.cancel()
+        # Events are queued before the operation completes
+        if not self._events.empty():
+            return self._events.get_nowait()
+        raise StopAsyncIteration
+
+
+def write(wim, *args, max_rate=DEFAULT_MAX_RATE, **kwargs):
+    """ Like WimFile.write, as an Operation """
+    return Operation(wim, lambda: wim.write(*args, **kwargs), max_rate=max_rate)
+
+
+def verify(wim, flags=0, max_rate=DEFAULT_MAX_RATE):
+    """ Like WimFile.verify, as an Operation """
+    return Operation(wim, wim.verify, flags, max_rate=max_rate)
+
+
+def extract(image, target, flags=0, max_rate=DEFAULT_MAX_RATE):
+    """ Like Image.extract, as an Operation """
+    return Operation(image._wim_obj, image.extract, target, flags, max_rate=max_rate)
+
+
+def add(images, source, name="", config="", flags=0, max_rate=DEFAULT_MAX_RATE):
+    """ Like ImageCollection.add, as an Operation; its result is the new Image """
+    return Operation(images._wim_obj, images.add, source, name, config, flags, max_rate=max_rate)
@@ -2,7 +2,7 @@ import cffi
 import platform
 import ctypes.util
 
-from wimlib.c_defs import WIMLIB_DEFAULT_CDEFS
+from wimlib.c_defs import CALLBACKS, WIMLIB_DEFAULT_CDEFS, get_platform_cdefs
 
 
 class WimBackend(object):
@@ -11,18 +11,58 @@ class WimBackend(object):
 
     This class creates the ffi and lib objects used by other wimlib
     classes. This class is for internal use only.
+
+    The precompiled API mode module (wimlib._wimlib_cffi, built by setup.py
+    from wimlib/_build.py) is used when available; otherwise the C
+    declarations are parsed at runtime and libwim is loaded in ABI mode.
+
+    callbacks holds one C function pointer per entry of c_defs.CALLBACKS,
+    calling the Python callable behind its void* context argument. In API mode
+    these are extern "Python" functions, so wimlib calls them without going
+    through a libffi closure.
     """
 
     def __init__(self):
         self.os_family = platform.system()
-        self.ffi = cffi.FFI()
+        try:
+            self.ffi, self.lib = self._load_compiled()
+            self.mode = "api"
+        except ImportError:
+            self.ffi, self.lib = self._load_abi()
+            self.mode = "abi"
+        self.encoding = self._get_platform_encoding()
+        self.callbacks = self._make_callbacks()
+
+
+    def _load_compiled(self):
+        from wimlib._wimlib_cffi import ffi, lib
+        return ffi, lib
+
+
+    def _load_abi(self):
+        ffi = cffi.FFI()
         # Add OS specific C wimlib declarations
         # for Windows and Linux wimlib_tchar defenition
-        self.ffi.cdef(self._get_platform_cdefs())
+        ffi.cdef(self._get_platform_cdefs())
         # Add default C wimlib declarations
-        self.ffi.cdef(WIMLIB_DEFAULT_CDEFS)
-        self.lib = self.ffi.dlopen(self._get_wimlib_path())
-        self.encoding = self._get_platform_encoding()
+        ffi.cdef(WIMLIB_DEFAULT_CDEFS)
+        return ffi, ffi.dlopen(self._get_wimlib_path())
+
+
+    def _make_callbacks(self):
+        from_handle = self.ffi.from_handle
+
+        def trampoline(*args):
+            return from_handle(args[-1])(*args[:-1])
+
+        callbacks = {}
+        for name, (cdecl, error) in CALLBACKS.items():
+            if self.mode == "api":
+                self.ffi.def_extern(name=f"_wimlib_{name}_callback", error=error)(trampoline)
+                callbacks[name] = getattr(self.lib, f"_wimlib_{name}_callback")
+            else:
+                callbacks[name] = self.ffi.callback(cdecl, trampoline, error=error)
+        return callbacks
 
 
     def _get_platform_encoding(self):
@@ -32,11 +72,7 @@ class WimBackend(object):
 
 
     def _get_platform_cdefs(self):
-        if self.os_family == "Windows":
-            # wimlib_tchar is a 'wchar' on windows
-            return "typedef wchar_t wimlib_tchar;"
-        # on any other platforms is a 'char'
-        return "typedef char wimlib_tchar;"
+        return get_platform_cdefs(self.os_family)
 
 
     def _get_wimlib_path(self):
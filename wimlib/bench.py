@@ -0,0 +1,314 @@
+"""
+Benchmarks for python-wimlib.
+
+Usage:
+    python -m wimlib.bench import [--runs N] [--json]
+    python -m wimlib.bench compression [--codecs LIST] [--block-sizes LIST] [--levels LIST]
+                                       [--threads LIST] [--size MB] [--file PATH ...] [--json]
+    python -m wimlib.bench write-stream WIM [--runs N] [--threads N] [--json]
+    python -m wimlib.bench xml WIM [--runs N] [--json]
+
+Every benchmark prints a plain text table, or JSON with --json.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+# Statements timed by the import benchmark, each in a fresh interpreter.
+# "backend" forces the FFI backend to load, which is what every "import wimlib"
+# used to cost before the backend was loaded lazily.
+IMPORT_SCENARIOS = (
+    ("wimlib", "import wimlib"),
+    ("wimlib.compression", "import wimlib.compression"),
+    ("wimlib.file", "import wimlib.file"),
+    ("backend", "import wimlib; wimlib._backend"),
+)
+
+_IMPORT_TIMER = ("import time; _t = time.perf_counter(); {stmt}; "
+                 "print(time.perf_counter() - _t)")
+
+
+# Runs one compression case in a fresh interpreter (argv: corpus file, ctype, block
+# size, level, threads), so that its peak RSS is not that of an earlier, larger case
+_COMPRESSION_CASE = ("import json, sys\n"
+                     "from wimlib import WimException\n"
+                     "from wimlib.bench import bench_compression_case\n"
+                     "with open(sys.argv[1], 'rb') as corpus_file: data = corpus_file.read()\n"
+                     "try: print(json.dumps(bench_compression_case(data, *map(int, sys.argv[2:]))))\n"
+                     "except WimException: print('null')")
+
+
+COMPRESSION_COLUMNS = ("corpus", "codec", "block_size", "level", "threads", "ratio",
+                       "compress_mbs", "decompress_mbs", "needed_memory", "peak_rss")
+
+_WORDS = (b"wimlib", b"image", b"resource", b"chunk", b"stream", b"metadata", b"the",
+          b"of", b"and", b"Windows", b"System32", b"driver", b"0x0000", b"\r\n")
+
+
+def _split_list(value, convert=str):
+    return [convert(item) for item in value.split(",") if item]
+
+
+def _peak_rss():
+    """ Peak resident set size of this process in bytes (None if unknown); it never
+        decreases, hence one process per compression case """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def synthetic_corpora(size):
+    """ Generate the synthetic corpora of size bytes: text-like and random data """
+    rand = random.Random(size)
+    words = []
+    length = 0
+    while length < size:
+        word = rand.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return {"text": b" ".join(words)[:size], "random": os.urandom(size)}
+
+
+def _chunks(data, block_size):
+    view = memoryview(data)
+    return [view[i:i + block_size] for i in range(0, len(data), block_size)]
+
+
+def bench_compression_case(data, ctype, block_size, level, threads):
+    """ Compress and decompress data once with these settings and return the measurements """
+    from wimlib import compression
+
+    chunks = _chunks(data, block_size)
+    with compression.ParallelCompressor(ctype, block_size, level, threads) as compressor:
+        start = time.perf_counter()
+        results = list(compressor.compress(chunks))
+        compress_time = time.perf_counter() - start
+
+    # Chunks that didn't shrink are stored as is, like in a WIM resource
+    stored = [(out_data if out_size else chunk, len(chunk)) for chunk, out_size, out_data in results]
+    with compression.ParallelDecompressor(ctype, block_size, threads) as decompressor:
+        start = time.perf_counter()
+        restored = list(decompressor.decompress(stored))
+        decompress_time = time.perf_counter() - start
+
+    if b"".join(restored) != data:
+        raise RuntimeError(f"Round trip mismatch ({ctype}, {block_size}, {level}, {threads})")
+
+    megabytes = len(data) / 1e6
+    return {"ratio": sum(len(out_data) for out_data, _ in stored) / max(len(data), 1),
+            "compress_mbs": megabytes / compress_time,
+            "decompress_mbs": megabytes / decompress_time,
+            "needed_memory": compression.get_compressor_needed_memory(ctype, block_size, level),
+            "peak_rss": _peak_rss()}
+
+
+def bench_compression(corpora, codecs, block_sizes, levels, threads):
+    """ Sweep codec x block size x level x thread count over the corpora (name -> bytes).
+        Every case runs in its own interpreter, so peak_rss is the peak of that case
+        (the corpus included). Combinations wimlib rejects (e.g. XPRESS above 64 KiB
+        blocks) are skipped. """
+    from wimlib import compression
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="wimlib-bench-") as tmpdir:
+        corpus_paths = {}
+        for i, (corpus, data) in enumerate(corpora.items()):
+            corpus_paths[corpus] = os.path.join(tmpdir, f"corpus{i}")
+            with open(corpus_paths[corpus], "wb") as corpus_file:
+                corpus_file.write(data)
+
+        for corpus, codec, block_size, level, thread_count in itertools.product(
+                corpora, codecs, block_sizes, levels, threads):
+            ctype = getattr(compression, f"COMPRESSION_TYPE_{codec.upper()}")
+            try:
+                compression.get_compressor_needed_memory(ctype, block_size, level)
+            except ValueError:
+                continue
+            out = subprocess.run([sys.executable, "-c", _COMPRESSION_CASE, corpus_paths[corpus],
+                                  *map(str, (ctype, block_size, level, thread_count))],
+                                 check=True, capture_output=True, text=True).stdout
+            if (case := json.loads(out.splitlines()[-1])) is None:
+                continue
+            results.append(dict(corpus=corpus, codec=codec.upper(), block_size=block_size, level=level,
+                                threads=thread_count, **case))
+    return results
+
+
+class _NullSink(object):
+    """ Write-only file object without a file descriptor, counting the bytes """
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return len(data)
+
+
+def bench_write_stream(wim_path, runs=3, threads="auto"):
+    """ Time writing wim_path as a pipable WIM to a local file (WimFile.write to its fd) and
+        with write_stream to a file object without a fd (pipe + pump thread) """
+    from wimlib.file import WimFile, WRITE_FLAG_PIPABLE
+
+    wim = WimFile.from_file(wim_path)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_path = os.path.join(tmp_dir, "out.wim")
+
+        def to_file():
+            with open(out_path, "wb") as out_file:
+                wim.write(out_file, flags=WRITE_FLAG_PIPABLE, threads=threads)
+            return os.path.getsize(out_path)
+
+        def to_object():
+            sink = _NullSink()
+            wim.write_stream(sink, threads=threads)
+            return sink.count
+
+        for name, func in (("local file", to_file), ("file object", to_object)):
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                size = func()
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            results.append({"target": name, "runs": runs, "bytes": size, "min_s": best, "mbs": size / 1e6 / best})
+    return results
+
+
+def bench_xml(wim_path, runs=5):
+    """ Time reading every property of every image one wimlib_get_image_property call
+        at a time, and from WimFile.xml (one XML fetch and parse); caches are dropped
+        before each run """
+    from wimlib.file import WimFile
+
+    wim = WimFile.from_file(wim_path)
+    names = {index: list(image.properties) for index, image in wim.images.items()}
+    count = sum(len(image_names) for image_names in names.values())
+
+    def per_property():
+        for index, image in wim.images.items():
+            for name in names[index]:
+                image.get_property(name)
+
+    def parsed():
+        for image in wim.images.values():
+            image.properties
+
+    results = []
+    for name, func in (("get_property", per_property), ("xml", parsed)):
+        times = []
+        for _ in range(runs):
+            wim._invalidate()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        results.append({"method": name, "runs": runs, "images": len(names), "properties": count,
+                        "min_ms": min(times) * 1000, "median_ms": statistics.median(times) * 1000})
+    return results
+
+
+def _print_table(rows, columns):
+    """ Print a list of dicts as a left aligned text table """
+    widths = [max([len(col)] + [len(_format_cell(row[col])) for row in rows]) for col in columns]
+    print("  ".join(col.ljust(width) for col, width in zip(columns, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(_format_cell(row[col]).ljust(width) for col, width in zip(columns, widths)))
+
+
+def _format_cell(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def bench_import(runs=10):
+    """ Time each import scenario in a fresh interpreter, in milliseconds """
+    results = []
+    for name, stmt in IMPORT_SCENARIOS:
+        times = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", _IMPORT_TIMER.format(stmt=stmt)],
+                                 check=True, capture_output=True, text=True).stdout
+            times.append(float(out.split()[-1]) * 1000)
+        results.append({"scenario": name, "runs": runs, "min_ms": min(times),
+                        "median_ms": statistics.median(times)})
+    return results
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="print results as JSON")
+    parser = argparse.ArgumentParser(prog="python -m wimlib.bench", description="python-wimlib benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", parents=[common],
+                                        help="import time of the package and its submodules")
+    import_parser.add_argument("--runs", type=int, default=10)
+
+    compression_parser = commands.add_parser("compression", parents=[common],
+                                             help="codec throughput, ratio and memory")
+    compression_parser.add_argument("--codecs", type=_split_list, default="XPRESS,LZX,LZMS")
+    compression_parser.add_argument("--block-sizes", type=lambda v: _split_list(v, int),
+                                    default="32768,131072,1048576")
+    compression_parser.add_argument("--levels", type=lambda v: _split_list(v, int), default="20,50,100")
+    compression_parser.add_argument("--threads", type=lambda v: _split_list(v, int), default=f"1,{os.cpu_count() or 1}")
+    compression_parser.add_argument("--size", type=float, default=16,
+                                    help="size of the synthetic corpora in MB (0 to skip them)")
+    compression_parser.add_argument("--file", action="append", default=[],
+                                    help="add a file as a corpus (may be repeated)")
+
+    stream_parser = commands.add_parser("write-stream", parents=[common],
+                                        help="pipable WIM write throughput, file vs file object")
+    stream_parser.add_argument("wim")
+    stream_parser.add_argument("--runs", type=int, default=3)
+    stream_parser.add_argument("--threads", type=lambda v: v if v == "auto" else int(v), default="auto")
+
+    xml_parser = commands.add_parser("xml", parents=[common],
+                                     help="image properties, per property calls vs parsed XML")
+    xml_parser.add_argument("wim")
+    xml_parser.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        results, columns = bench_import(args.runs), ("scenario", "runs", "min_ms", "median_ms")
+    elif args.command == "compression":
+        corpora = synthetic_corpora(int(args.size * 1e6)) if args.size else {}
+        for path in args.file:
+            with open(path, "rb") as corpus_file:
+                corpora[os.path.basename(path)] = corpus_file.read()
+        results = bench_compression(corpora, args.codecs, args.block_sizes, args.levels,
+                                    sorted(set(args.threads)))
+        columns = COMPRESSION_COLUMNS
+    elif args.command == "write-stream":
+        results = bench_write_stream(args.wim, args.runs, args.threads)
+        columns = ("target", "runs", "bytes", "min_s", "mbs")
+    elif args.command == "xml":
+        results = bench_xml(args.wim, args.runs)
+        columns = ("method", "runs", "images", "properties", "min_ms", "median_ms")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_table(results, columns)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Read-only file objects over the blobs (file contents) of a WIM, reading them
+straight from the WIM file instead of extracting them:
+
+    with image.open("/Windows/System32/config/SYSTEM") as hive:
+        header = hive.read(4096)
+
+The WIM file is memory mapped. Uncompressed resources are read from the
+mapping directly; compressed ones are decompressed one chunk at a time, the
+last chunk of each resource being kept for the following reads.
+"""
+import io
+import mmap
+import struct
+import sys
+import threading
+from array import array
+
+from wimlib import WimException, compression
+
+# Header of a solid resource: uncompressed size, chunk size, compression type
+_SOLID_HEADER = struct.Struct("<QII")
+
+
+class WimData(object):
+    """ Memory mapping of a WIM file and the resources opened in it, one per WimFile """
+    def __init__(self, path, compression_type, chunk_size):
+        self.compression_type = compression_type
+        self.chunk_size = chunk_size
+        with open(path, "rb") as wim_file:
+            self.mapping = mmap.mmap(wim_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._resources = {}
+        self._lock = threading.Lock()
+
+
+    def open(self, entry):
+        """ BlobReader of a lookup table entry (a wimlib.file.ResourceEntry) """
+        from wimlib.file import ResourceTable
+        if entry.flags & ResourceTable.FLAG_PACKED:
+            resource = self._resource(entry.raw_resource_offset, entry.raw_resource_compressed_size,
+                                      entry.raw_resource_uncompressed_size, solid=True)
+            return BlobReader(resource, entry.offset, entry.uncompressed_size)
+        if entry.flags & ResourceTable.FLAG_COMPRESSED:
+            resource = self._resource(entry.offset, entry.compressed_size, entry.uncompressed_size)
+            return BlobReader(resource, 0, entry.uncompressed_size)
+        return BlobReader(_MappedResource(self.mapping, entry.offset), 0, entry.uncompressed_size)
+
+
+    def _resource(self, offset, stored_size, size, solid=False):
+        with self._lock:
+            if (resource := self._resources.get(offset)) is None:
+                if solid:
+                    size, chunk_size, ctype = _SOLID_HEADER.unpack_from(self.mapping, offset)
+                    resource = _CompressedResource(self.mapping, offset + _SOLID_HEADER.size,
+                                                   stored_size - _SOLID_HEADER.size, size, ctype, chunk_size, True)
+                else:
+                    resource = _CompressedResource(self.mapping, offset, stored_size, size,
+                                                   self.compression_type, self.chunk_size, False)
+                self._resources[offset] = resource
+            return resource
+
+
+class _MappedResource(object):
+    """ Uncompressed resource, read from the mapping """
+    def __init__(self, mapping, offset):
+        self.mapping = mapping
+        self.offset = offset
+
+
+    def readinto(self, view, position):
+        start = self.offset + position
+        view[:] = self.mapping[start:start + len(view)]
+
+
+class _CompressedResource(object):
+    """
+    Chunked compressed resource. The chunk table precedes the chunks: in
+    regular resources it holds the offsets of chunks 1..n-1 (8 bytes each for
+    resources over 4 GiB, else 4), in solid resources the stored size of every
+    chunk (4 bytes each). Chunks that did not shrink are stored uncompressed.
+    """
+    def __init__(self, mapping, offset, stored_size, size, ctype, chunk_size, solid):
+        self.mapping = mapping
+        self.size = size
+        self.compression_type = ctype
+        self.chunk_size = chunk_size
+        num_chunks = -(-size // chunk_size)
+        if solid:
+            sizes = _read_table(mapping, offset, num_chunks, "I")
+            table_size = len(sizes) * sizes.itemsize
+            self.offsets = array("Q", [0])
+            for stored in sizes:
+                self.offsets.append(self.offsets[-1] + stored)
+        else:
+            starts = _read_table(mapping, offset, num_chunks - 1, "Q" if size > 0xffffffff else "I")
+            table_size = len(starts) * starts.itemsize
+            self.offsets = array("Q", [0, *starts])
+            self.offsets.append(stored_size - table_size)
+        self.data_offset = offset + table_size
+        self._chunk_index = -1
+        self._chunk = None
+        self._lock = threading.Lock()
+
+
+    def _get_chunk(self, index):
+        """ Uncompressed data of chunk number index """
+        with self._lock:
+            if index != self._chunk_index:
+                size = min(self.chunk_size, self.size - index * self.chunk_size)
+                start, end = self.data_offset + self.offsets[index], self.data_offset + self.offsets[index + 1]
+                if end - start == size:
+                    self._chunk = self.mapping[start:end]
+                else:
+                    with compression.pool.decompressor(self.compression_type, self.chunk_size) as decompressor:
+                        self._chunk = decompressor.decompress(memoryview(self.mapping)[start:end], size)
+                self._chunk_index = index
+            return self._chunk
+
+
+    def readinto(self, view, position):
+        done = 0
+        while done < len(view):
+            index, skip = divmod(position + done, self.chunk_size)
+            chunk = self._get_chunk(index)
+            count = min(len(chunk) - skip, len(view) - done)
+            view[done:done + count] = chunk[skip:skip + count]
+            done += count
+
+
+def _read_table(mapping, offset, count, typecode):
+    table = array(typecode)
+    end = offset + count * table.itemsize
+    if end > len(mapping):
+        raise WimException("Chunk table out of the bounds of the WIM file.")
+    table.frombytes(mapping[offset:end])
+    if sys.byteorder == "big":
+        table.byteswap()
+    return table
+
+
+class BlobReader(io.RawIOBase):
+    """ Read-only, seekable binary file object over size bytes of a resource, from offset """
+    def __init__(self, resource, offset, size):
+        self._resource = resource
+        self._offset = offset
+        self.size = size
+        self._pos = 0
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self._pos
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Error: invalid whence ({0}).".format(whence))
+        self._pos = max(offset, 0)
+        return self._pos
+
+
+    def readinto(self, b):
+        self._checkClosed()
+        view = memoryview(b).cast("B")
+        count = max(min(len(view), self.size - self._pos), 0)
+        if count:
+            self._resource.readinto(view[:count], self._offset + self._pos)
+            self._pos += count
+        return count
+
+
+    def readall(self):
+        return self.read(max(self.size - self._pos, 0))
+
+
+    def close(self):
+        self._resource = None
+        super(BlobReader, self).close()
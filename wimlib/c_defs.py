@@ -256,7 +256,7 @@ int wimlib_delete_path(WIMStruct *wim, int image, const wimlib_tchar *path, int
 int wimlib_export_image(WIMStruct *src_wim, int src_image, WIMStruct *dest_wim, const wimlib_tchar *dest_name, const wimlib_tchar *dest_description, int export_flags);
 int wimlib_extract_image(WIMStruct *wim, int image, const wimlib_tchar *target, int extract_flags);
 int wimlib_extract_image_from_pipe(int pipe_fd, const wimlib_tchar *image_num_or_name, const wimlib_tchar *target, int extract_flags);
-//int wimlib_extract_image_from_pipe_with_progress(int pipe_fd, const wimlib_tchar *image_num_or_name, const wimlib_tchar *target, int extract_flags, wimlib_progress_func_t progfunc, void *progctx);
+int wimlib_extract_image_from_pipe_with_progress(int pipe_fd, const wimlib_tchar *image_num_or_name, const wimlib_tchar *target, int extract_flags, wimlib_progress_func_t progfunc, void *progctx);
 int wimlib_extract_pathlist(WIMStruct *wim, int image, const wimlib_tchar *target, const wimlib_tchar *path_list_file, int extract_flags);
 int wimlib_extract_paths(WIMStruct *wim, int image, const wimlib_tchar *target, const wimlib_tchar * const *paths, size_t num_paths, int extract_flags);
 int wimlib_extract_xml_data(WIMStruct *wim, FILE *fp);
@@ -318,3 +318,31 @@ int wimlib_decompress(const void *compressed_data, size_t compressed_size, void
 void wimlib_free_decompressor(struct wimlib_decompressor *decompressor);
 """
 
+# Callbacks passed to wimlib, as name -> (C type, value returned if the Python
+# code raises: WIMLIB_PROGRESS_STATUS_ABORT, WIMLIB_ERR_ABORTED_BY_PROGRESS, so that
+# wimlib stops). The compiled backend declares each as an extern "Python"
+# function _wimlib_<name>_callback, see get_callback_cdefs.
+CALLBACKS = {
+    "progress": ("enum wimlib_progress_status(enum wimlib_progress_msg, union wimlib_progress_info *, void *)", 1),
+    "dir_entry": ("int(const struct wimlib_dir_entry *, void *)", 76),
+    "resource_entry": ("int(const struct wimlib_resource_entry *, void *)", 76),
+}
+
+
+def get_callback_cdefs():
+    """ Return the extern "Python" declarations of CALLBACKS, for the API mode build """
+    cdefs = []
+    for name, (cdecl, _) in CALLBACKS.items():
+        result, arguments = cdecl.split("(", 1)
+        cdefs.append(f'extern "Python" {result} _wimlib_{name}_callback({arguments};')
+    return "\n".join(cdefs)
+
+
+
+def get_platform_cdefs(os_family):
+    """ Return the OS specific C declarations (the wimlib_tchar definition) """
+    if os_family == "Windows":
+        # wimlib_tchar is a 'wchar' on windows
+        return "typedef wchar_t wimlib_tchar;"
+    # on any other platforms is a 'char'
+    return "typedef char wimlib_tchar;"
@@ -1,3 +1,14 @@
+import array
+import builtins
+import collections
+import contextlib
+import io
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from wimlib import _lib, _ffi, WimException
 
 COMPRESSOR_FLAG_DESTRUCTIVE = 0x80000000
@@ -6,6 +17,20 @@ COMPRESSION_TYPE_XPRESS = 1
 COMPRESSION_TYPE_LZX = 2
 COMPRESSION_TYPE_LZMS = 3
 
+# Larger block sizes and higher levels (0 = default, 50) trade throughput and
+# memory for ratio; XPRESS is limited to 64 KiB blocks and LZX to 2 MiB.
+# "python -m wimlib.bench compression" measures the trade-off on a host.
+
+# Chunked container written by wimlib.compression.open(): a header, one record
+# per chunk (<i in_size><i out_size> + data, as in examples/compressfile.py),
+# the record offsets of every chunk and a footer locating them.
+CHUNKED_FILE_MAGIC = b"WLCF"
+CHUNKED_FILE_INDEX_MAGIC = b"WLCI"
+CHUNKED_FILE_VERSION = 1
+_CHUNKED_HEADER = struct.Struct("<4sIiI")  # magic, version, compression type, chunk size
+_CHUNK_HEADER = struct.Struct("<ii")  # uncompressed size, stored size
+_CHUNKED_FOOTER = struct.Struct("<QQ4s")  # uncompressed size, index offset, index magic
+
 
 class Compressor(object):
     def __init__(self, compression_type, block_size=0, level=0, dont_create=False):
@@ -13,6 +38,7 @@ class Compressor(object):
         self.block_size = block_size
         self.level = level
         self._compressor = None
+        self._out_buffer = None
         if not dont_create:
             self.create()
 
@@ -29,18 +55,26 @@ class Compressor(object):
         self._compressor = compressor[0]
 
     def compress(self, data):
-        out_buffer = _ffi.new(
-            "unsigned char[{0}]".format(self.block_size))
+        """ Compress data, returns (compressed size, compressed bytes); size is 0 if it didn't shrink """
+        if self._out_buffer is None:
+            # Scratch output buffer, reused by every call
+            self._out_buffer = _ffi.new("unsigned char[]", self.block_size)
+        data = _ffi.from_buffer(data)
+        # Room for less than the data, so that output of its size is reported as 0
         out_size = _lib.wimlib_compress(
-            data, len(data), out_buffer, self.block_size, self._compressor)
-        return (out_size, bytes(_ffi.buffer(out_buffer, out_size)))
+            data, len(data), self._out_buffer, min(self.block_size, max(len(data) - 1, 0)), self._compressor)
+        return (out_size, _ffi.buffer(self._out_buffer, out_size)[:])
+
+    def compress_into(self, src, dst):
+        """ Compress the buffer src into the writable buffer dst, returns the number of
+            bytes written (0 if the data did not fit in dst) """
+        src = _ffi.from_buffer(src)
+        dst = _from_writable_buffer(dst)
+        return _lib.wimlib_compress(src, len(src), dst, len(dst), self._compressor)
 
     def needed_memory(self):
-        ret = _lib.wimlib_get_compressor_needed_memory(
+        return get_compressor_needed_memory(
             self.compression_type, self.block_size, self.level)
-        if not ret:
-            raise ValueError(
-                "Error: compression type or block size are incorrect")
 
 
 class Decompressor(object):
@@ -48,6 +82,7 @@ class Decompressor(object):
         self.compression_type = compression_type
         self.block_size = block_size
         self._decompressor = None
+        self._out_buffer = None
         if not dont_create:
             self.create()
 
@@ -64,13 +99,431 @@ class Decompressor(object):
         self._decompressor = decompressor[0]
 
     def decompress(self, data, original_size):
-        out_buffer = _ffi.new(
-            "unsigned char[{0}]".format(original_size))
+        if original_size <= self.block_size:
+            if self._out_buffer is None:
+                # Scratch output buffer, reused by every call
+                self._out_buffer = _ffi.new("unsigned char[]", self.block_size)
+            out_buffer = self._out_buffer
+        else:
+            out_buffer = _ffi.new("unsigned char[]", original_size)
+        self._decompress(_ffi.from_buffer(data), out_buffer, original_size)
+        return _ffi.buffer(out_buffer, original_size)[:]
+
+    def decompress_into(self, src, dst, size):
+        """ Decompress the buffer src into the writable buffer dst, size is the
+            uncompressed size. Returns the number of bytes written. """
+        dst = _from_writable_buffer(dst)
+        if len(dst) < size:
+            raise ValueError("Error: dst is smaller than the uncompressed size ({0} < {1})".format(len(dst), size))
+        self._decompress(_ffi.from_buffer(src), dst, size)
+        return size
+
+    def _decompress(self, src, dst, size):
         ret = _lib.wimlib_decompress(
-            data, len(data), out_buffer, original_size, self._decompressor)
+            src, len(src), dst, size, self._decompressor)
         if ret:
             raise WimException("wimlib_decompress returned {0}.".format(ret))
-        return bytes(_ffi.buffer(out_buffer, original_size))
+
+
+class CodecPool(object):
+    """
+    Pool of reusable Compressor and Decompressor handles.
+
+    Handles are keyed by (compression type, block size, level). Idle handles are
+    kept while their memory (from wimlib_get_compressor_needed_memory) fits in
+    budget bytes; the least recently returned ones are freed first. wimlib has
+    no memory query for decompressors, they are charged by their block size.
+    """
+    def __init__(self, budget=256 * 1024 * 1024):
+        self.budget = budget
+        self.memory = 0
+        # key -> [(handle, cost), ...], least recently used key first
+        self._idle = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_compressor(self, compression_type, block_size, level=0):
+        """ Take a compressor out of the pool, creating one if none is idle """
+        handle = self._take(("compressor", compression_type, block_size, level))
+        return handle or Compressor(compression_type, block_size, level)
+
+    def get_decompressor(self, compression_type, block_size):
+        """ Take a decompressor out of the pool, creating one if none is idle """
+        handle = self._take(("decompressor", compression_type, block_size))
+        return handle or Decompressor(compression_type, block_size)
+
+    def put(self, handle):
+        """ Return a handle taken with get_compressor() / get_decompressor() """
+        if isinstance(handle, Compressor):
+            key = ("compressor", handle.compression_type, handle.block_size, handle.level)
+            cost = handle.needed_memory()
+        else:
+            key = ("decompressor", handle.compression_type, handle.block_size)
+            cost = handle.block_size
+        if cost > self.budget:
+            return
+
+        with self._lock:
+            self._idle.setdefault(key, []).append((handle, cost))
+            self._idle.move_to_end(key)
+            self.memory += cost
+            self._evict(self.budget)
+
+    @contextlib.contextmanager
+    def compressor(self, compression_type, block_size, level=0):
+        """ with pool.compressor(...) as compressor: ... """
+        handle = self.get_compressor(compression_type, block_size, level)
+        try:
+            yield handle
+        finally:
+            self.put(handle)
+
+    @contextlib.contextmanager
+    def decompressor(self, compression_type, block_size):
+        """ with pool.decompressor(...) as decompressor: ... """
+        handle = self.get_decompressor(compression_type, block_size)
+        try:
+            yield handle
+        finally:
+            self.put(handle)
+
+    def resize(self, budget):
+        """ Change the memory budget, freeing idle handles over it right away """
+        with self._lock:
+            self.budget = budget
+            self._evict(budget)
+
+    def clear(self):
+        """ Free all idle handles """
+        with self._lock:
+            self._evict(0)
+
+    def _take(self, key):
+        with self._lock:
+            handles = self._idle.get(key)
+            if not handles:
+                return None
+            handle, cost = handles.pop()
+            if not handles:
+                del self._idle[key]
+            self.memory -= cost
+            return handle
+
+    def _evict(self, budget):
+        """ Drop least recently used idle handles until memory fits budget. Call with the lock held. """
+        while self.memory > budget:
+            key, handles = next(iter(self._idle.items()))
+            handle, cost = handles.pop(0)
+            if not handles:
+                del self._idle[key]
+            self.memory -= cost
+
+
+# Process-wide handle pool
+pool = CodecPool()
+
+
+class _ParallelCodec(object):
+    """
+    Base class for ParallelCompressor and ParallelDecompressor.
+
+    Chunks are processed by a thread pool; every worker thread owns its own
+    native handle since wimlib compressors/decompressors are not thread-safe.
+    cffi releases the GIL around wimlib_compress/wimlib_decompress, so the
+    workers run in parallel. At most max_in_flight chunks are queued or held
+    as results at any time.
+    """
+    def __init__(self, threads=None, max_in_flight=None):
+        self.threads = threads or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or 2 * self.threads
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(self.threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Stop the worker threads, their handles are freed with them """
+        self._executor.shutdown()
+
+    def _handle(self):
+        """ Get the native handle of the calling worker thread """
+        handle = getattr(self._local, "handle", None)
+        if handle is None:
+            handle = self._local.handle = self._create_handle()
+        return handle
+
+    def _map(self, func, chunks):
+        """ Like Executor.map, but lazy on the input and bounded by max_in_flight """
+        pending = collections.deque()
+        for chunk in chunks:
+            if len(pending) >= self.max_in_flight:
+                yield pending.popleft().result()
+            pending.append(self._executor.submit(func, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+
+class ParallelCompressor(_ParallelCodec):
+    def __init__(self, compression_type, block_size, level=0, threads=None, max_in_flight=None):
+        self.compression_type = compression_type
+        self.block_size = block_size
+        self.level = level
+        super(ParallelCompressor, self).__init__(threads, max_in_flight)
+
+    def _create_handle(self):
+        return Compressor(self.compression_type, self.block_size, self.level)
+
+    def _compress(self, chunk):
+        return (chunk,) + self._handle().compress(chunk)
+
+    def compress(self, chunks):
+        """ Compress an iterable of chunks, yields (chunk, out_size, out_data) in input
+            order; out_size is 0 when the chunk did not compress, as in Compressor.compress """
+        return self._map(self._compress, chunks)
+
+
+class ParallelDecompressor(_ParallelCodec):
+    def __init__(self, compression_type, block_size, threads=None, max_in_flight=None):
+        self.compression_type = compression_type
+        self.block_size = block_size
+        super(ParallelDecompressor, self).__init__(threads, max_in_flight)
+
+    def _create_handle(self):
+        return Decompressor(self.compression_type, self.block_size)
+
+    def _decompress(self, chunk):
+        data, original_size = chunk
+        if len(data) == original_size:
+            # Stored uncompressed
+            return bytes(data)
+        return self._handle().decompress(data, original_size)
+
+    def decompress(self, chunks):
+        """ Decompress an iterable of (data, original_size) pairs, yields the data in input
+            order. Chunks where len(data) == original_size are taken as stored uncompressed. """
+        return self._map(self._decompress, chunks)
+
+
+def open(file, mode="rb", ctype=COMPRESSION_TYPE_LZX, chunk_size=32768, level=0):
+    """ Open a chunked compressed file (a path or a binary file object), like gzip.open().
+        ctype, chunk_size and level are only used when writing. """
+    return ChunkedFile(file, mode, ctype, chunk_size, level)
+
+
+class ChunkedFile(io.BufferedIOBase):
+    """
+    File-like object for the chunked container format, returned by open().
+
+    Data is compressed in independent chunks of chunk_size bytes. When reading,
+    the trailing chunk index lets seek() and read() decompress only the chunks
+    they touch. Writing is sequential; the index is written on close().
+    """
+    def __init__(self, file, mode="rb", ctype=COMPRESSION_TYPE_LZX, chunk_size=32768, level=0):
+        mode = mode.replace("b", "")
+        if mode not in ("r", "w"):
+            raise ValueError("Error: invalid mode {0!r}, expected 'rb' or 'wb'.".format(mode))
+        self.mode = mode
+
+        if hasattr(file, "read") or hasattr(file, "write"):
+            self._fp, self._close_fp = file, False
+        else:
+            self._fp, self._close_fp = builtins.open(file, mode + "b"), True
+        # Chunk offsets are relative to the start of the container
+        self._start = self._fp.tell()
+        self._pos = 0
+
+        try:
+            if mode == "w":
+                self._init_write(ctype, chunk_size, level)
+            else:
+                self._init_read()
+        except:
+            if self._close_fp:
+                self._fp.close()
+            raise
+
+    def _init_write(self, ctype, chunk_size, level):
+        self.compression_type = ctype
+        self.chunk_size = chunk_size
+        self._compressor = Compressor(ctype, chunk_size, level)
+        self._compressed = bytearray(chunk_size)
+        self._pending = bytearray()
+        self._offsets = array.array("Q")
+        self._fp.write(_CHUNKED_HEADER.pack(CHUNKED_FILE_MAGIC, CHUNKED_FILE_VERSION, ctype, chunk_size))
+
+    def _init_read(self):
+        magic, version, self.compression_type, self.chunk_size = _CHUNKED_HEADER.unpack(
+            self._read_exact(_CHUNKED_HEADER.size))
+        if magic != CHUNKED_FILE_MAGIC or version != CHUNKED_FILE_VERSION:
+            raise ValueError("Error: not a chunked compressed file (version {0}).".format(CHUNKED_FILE_VERSION))
+
+        self._fp.seek(-_CHUNKED_FOOTER.size, io.SEEK_END)
+        self._size, index_offset, magic = _CHUNKED_FOOTER.unpack(self._read_exact(_CHUNKED_FOOTER.size))
+        if magic != CHUNKED_FILE_INDEX_MAGIC:
+            raise ValueError("Error: chunk index not found, the file is truncated or was not closed.")
+
+        num_chunks = -(-self._size // self.chunk_size)
+        self._fp.seek(self._start + index_offset)
+        self._offsets = array.array("Q")
+        self._offsets.frombytes(self._read_exact(num_chunks * self._offsets.itemsize))
+        if sys.byteorder == "big":
+            self._offsets.byteswap()
+
+        self._decompressor = Decompressor(self.compression_type, self.chunk_size)
+        # The last chunk touched by a partial read is cached
+        self._chunk = bytearray(self.chunk_size)
+        self._chunk_index = -1
+        self._chunk_size = 0
+
+    def _read_exact(self, size):
+        data = self._fp.read(size)
+        if len(data) != size:
+            raise EOFError("Error: expected {0} bytes, got {1}.".format(size, len(data)))
+        return data
+
+    def _check_mode(self, mode):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self.mode != mode:
+            raise io.UnsupportedOperation("File not open for {0}.".format("reading" if mode == "r" else "writing"))
+
+    def readable(self):
+        return self.mode == "r"
+
+    def writable(self):
+        return self.mode == "w"
+
+    def seekable(self):
+        return self.mode == "r"
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._check_mode("r")
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        elif whence != io.SEEK_SET:
+            raise ValueError("Error: invalid whence ({0}).".format(whence))
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def _read_chunk(self, index, dst):
+        """ Read chunk number index into the writable buffer dst, returns its uncompressed size """
+        self._fp.seek(self._start + self._offsets[index])
+        in_size, out_size = _CHUNK_HEADER.unpack(self._read_exact(_CHUNK_HEADER.size))
+        if out_size == in_size:
+            # Stored uncompressed
+            if self._fp.readinto(memoryview(dst)[:in_size]) != in_size:
+                raise EOFError("Error: chunk {0} is truncated.".format(index))
+        else:
+            self._decompressor.decompress_into(self._read_exact(out_size), dst, in_size)
+        return in_size
+
+    def readinto(self, b):
+        self._check_mode("r")
+        view = memoryview(b).cast("B")
+        total = 0
+        while total < len(view) and self._pos < self._size:
+            index, skip = divmod(self._pos, self.chunk_size)
+            if not skip and len(view) - total >= self.chunk_size and index != self._chunk_index:
+                # Whole chunk wanted, decompress straight into the caller's buffer
+                count = self._read_chunk(index, view[total:])
+            else:
+                if index != self._chunk_index:
+                    self._chunk_size = self._read_chunk(index, self._chunk)
+                    self._chunk_index = index
+                count = min(self._chunk_size - skip, len(view) - total)
+                view[total:total + count] = self._chunk[skip:skip + count]
+            total += count
+            self._pos += count
+        return total
+
+    def read(self, size=-1):
+        self._check_mode("r")
+        if size is None or size < 0:
+            size = max(self._size - self._pos, 0)
+        buf = bytearray(size)
+        del buf[self.readinto(buf):]
+        return bytes(buf)
+
+    read1 = read
+
+    def write(self, b):
+        self._check_mode("w")
+        with memoryview(b) as view:
+            self._pending += view.cast("B")
+            count = view.nbytes
+        if len(self._pending) >= self.chunk_size:
+            done = 0
+            while len(self._pending) - done >= self.chunk_size:
+                self._write_chunk(self._pending[done:done + self.chunk_size])
+                done += self.chunk_size
+            del self._pending[:done]
+        self._pos += count
+        return count
+
+    def _write_chunk(self, data):
+        self._offsets.append(self._fp.tell() - self._start)
+        # A chunk is read back as stored when its stored size is its size, so the
+        # compressed data must be smaller than the chunk
+        out_size = 0
+        if len(data) > 1:
+            out_size = self._compressor.compress_into(data, memoryview(self._compressed)[:len(data) - 1])
+        out_data = memoryview(self._compressed)[:out_size]
+        if not out_size:
+            # Didn't compress, store it as is
+            out_size, out_data = len(data), data
+        self._fp.write(_CHUNK_HEADER.pack(len(data), out_size))
+        self._fp.write(out_data)
+
+    def flush(self):
+        if self.mode == "w" and not self.closed:
+            self._fp.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.mode == "w":
+                if self._pending:
+                    self._write_chunk(self._pending)
+                    del self._pending[:]
+                index_offset = self._fp.tell() - self._start
+                offsets = array.array("Q", self._offsets)
+                if sys.byteorder == "big":
+                    offsets.byteswap()
+                self._fp.write(offsets.tobytes())
+                self._fp.write(_CHUNKED_FOOTER.pack(self._pos, index_offset, CHUNKED_FILE_INDEX_MAGIC))
+                self._fp.flush()
+        finally:
+            try:
+                super(ChunkedFile, self).close()
+            finally:
+                if self._close_fp:
+                    self._fp.close()
+
+
+def _from_writable_buffer(buf):
+    """ ffi.from_buffer() that refuses read-only buffers such as bytes. For internal use. """
+    if memoryview(buf).readonly:
+        raise TypeError("Error: output buffer must be writable (e.g. bytearray, memoryview or mmap)")
+    return _ffi.from_buffer(buf)
+
+
+def get_compressor_needed_memory(compression_type, block_size, level=0):
+    """ Get the memory in bytes a compressor with these parameters would need """
+    ret = _lib.wimlib_get_compressor_needed_memory(
+        compression_type, block_size, level)
+    if not ret:
+        raise ValueError(
+            "Error: compression type or block size are incorrect")
+    return ret
 
 
 def set_default_compression_level(compression_type, level):
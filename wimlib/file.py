@@ -1,8 +1,18 @@
+import collections
+import contextlib
+import heapq
 import logging
+import os
+import threading
+import time
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from wimlib import _lib, _ffi, WimException
-from wimlib.image import ImageCollection
-from wimlib.info import WimInfo
+import wimlib
+from wimlib import _lib, _ffi, WimException, pipe
+from wimlib.image import Image, ImageCollection, _EntryCallback
+from wimlib.info import WimInfo, WimXml
+from wimlib.progress import ProgressDispatcher
 
 
 #Shorthand names
@@ -11,11 +21,39 @@ from wimlib.info import WimInfo
 NO_IMAGE = 0
 ALL_IMAGES = -1
 
+# Write flags
+WRITE_FLAG_CHECK_INTEGRITY =              0x00000001
+WRITE_FLAG_NO_CHECK_INTEGRITY =           0x00000002
+WRITE_FLAG_PIPABLE =                      0x00000004
+WRITE_FLAG_NOT_PIPABLE =                  0x00000008
+WRITE_FLAG_RECOMPRESS =                   0x00000010
+WRITE_FLAG_FSYNC =                        0x00000020
+WRITE_FLAG_REBUILD =                      0x00000040
+WRITE_FLAG_SOFT_DELETE =                  0x00000080
+WRITE_FLAG_IGNORE_READONLY_FLAG =         0x00000100
+WRITE_FLAG_SKIP_EXTERNAL_WIMS =           0x00000200
+WRITE_FLAG_STREAMS_OK =                   0x00000400
+WRITE_FLAG_RETAIN_GUID =                  0x00000800
+WRITE_FLAG_SOLID =                        0x00001000
+WRITE_FLAG_SEND_DONE_WITH_FILE_MESSAGES = 0x00002000
+WRITE_FLAG_NO_SOLID_SORT =                0x00004000
+WRITE_FLAG_UNSAFE_COMPACT =               0x00008000
+
+
 
 class WimFile(object):
     # Specialized constructor for calling backend functions easily.
     def __init__(self, loader, path="", has_baking_file=False):
         self._has_baking_file = has_baking_file
+        self._progress = None
+        self._resources = None
+        self._data = None
+        # Metadata cache (info, XML, image properties) of the current generation
+        self._generation = 0
+        self._cache = {}
+        # Set by set_output_(pack_)compression_type; None means the default
+        self._output_compression_type = None
+        self._output_pack_compression_type = None
         self.path = path = str(path)
 
         if (error := loader(path.encode(), wim_struct := _ffi.new("WIMStruct **"))):
@@ -29,6 +67,33 @@ class WimFile(object):
         _lib.wimlib_free(self._wim_struct)
 
 
+    def _invalidate(self):
+        """ Drop cached data after the WIM was modified. For internal use. """
+        self._generation += 1
+        self._cache.clear()
+        self._resources = None
+        self._data = None
+
+
+    @property
+    def generation(self):
+        """ Counter incremented by every change to the WIM, for callers caching data about it """
+        return self._generation
+
+
+    def _cached(self, key, load):
+        """ Value of key in the metadata cache, from load() on a miss. For internal use. """
+        try:
+            return self._cache[key]
+        except KeyError:
+            generation = self._generation
+            value = load()
+            # Not cached if the WIM changed while loading
+            if generation == self._generation:
+                self._cache[key] = value
+            return value
+
+
     @staticmethod
     def new(compression=0):
         loader = lambda p, s: _lib.wimlib_create_new_wim(compression, s)
@@ -36,30 +101,37 @@ class WimFile(object):
 
 
     @staticmethod
-    def from_file(path, flags=0, callback=None, context=None):
+    def from_file(path, flags=0, callback=None, context=None, max_rate=None):
+        """ Open a WIM file. callback(event, context) receives ProgressEvent objects,
+            at most max_rate per second for high frequency messages. """
         if not callback:
             logging.debug(f"Loading WimFile from {path}, non-progressive loader.")
             loader = lambda p, s: _lib.wimlib_open_wim(p, flags, s)
         else:
             logging.debug(f"Loading WimFile from {path}, progressive loader.")
-            @_ffi.callback("enum wimlib_progress_status(enum wimlib_progress_msg, union wimlib_progress_info*, void*)")
-            def __wrapper(progress_msg, progress_info, user_context):
-                user_context = _ffi.from_handle(user_context)
-                # TODO: Cast progress_info to a pythonic object instead of C union.
-                ret_val = callback(progress_msg, progress_info, user_context)
-                return ret_val if ret_val is not None else 0
-
-            loader = lambda p, s: _lib.wimlib_open_wim_with_progress(p, flags,
-                                             s, __wrapper, _ffi.new_handle(context))
-        return WimFile(loader, path, flags)
-
-
-    def write(self, fd=None, image=ALL_IMAGES, flags=None, threads=4):
+            dispatcher = ProgressDispatcher(callback, context, max_rate)
+
+            def loader(p, s):
+                ret = _lib.wimlib_open_wim_with_progress(p, flags, s, dispatcher.c_callback, dispatcher.c_context)
+                dispatcher.raise_pending()
+                return ret
+        wim = WimFile(loader, path, flags)
+        if callback:
+            # wimlib_open_wim_with_progress leaves the callback registered on the WIMStruct
+            wim._progress = dispatcher
+        return wim
+
+
+    def write(self, fd=None, image=ALL_IMAGES, flags=None, threads="auto"):
+        """ Write the WIM to its path, to fd, or over its backing file. threads="auto"
+            sizes the compression threads for the host and codec (see wimlib.tuning). """
         if not self.path:
             raise WimException("No path / file to write to.")
 
-        path = _ffi.new("char[]", self.path)
+        path = _ffi.new("char[]", self.path.encode())
         flags = flags if flags is not None else 0
+        if threads == "auto":
+            threads = self._auto_threads(flags)
 
         if not self._has_baking_file:
             if fd:
@@ -69,10 +141,62 @@ class WimFile(object):
         else:
             ret = _lib.wimlib_overwrite(self._wim_struct, flags, threads)
 
+        self._invalidate()
         if ret:
             raise WimException(ret)
 
 
+    def write_stream(self, fileobj, image=ALL_IMAGES, flags=0, threads="auto", buffer_size=pipe.BUFFER_SIZE):
+        """ Write a pipable WIM to fileobj: an fd, a socket, or any object with a write()
+            method (an SSL socket, a gzip file...). libwim writes to fds, plain sockets and
+            binary files (flushed first) directly; other objects are fed through a pipe by
+            a pump thread, in buffer_size pieces from a reused buffer (so fileobj.write
+            must not keep the memoryview it is passed). """
+        flags |= WRITE_FLAG_PIPABLE
+        if threads == "auto":
+            threads = self._auto_threads(flags)
+
+        fd = pipe.get_fileno(fileobj, writing=True)
+        if fd is not None:
+            if hasattr(fileobj, "flush"):
+                fileobj.flush()
+            ret = _lib.wimlib_write_to_fd(self._wim_struct, fd, image, flags, threads)
+        else:
+            read_fd, write_fd = os.pipe()
+            pipe.grow(write_fd, buffer_size)
+            pump = pipe.PipeDrain(read_fd, fileobj, buffer_size)
+            pump.start()
+            try:
+                ret = _lib.wimlib_write_to_fd(self._wim_struct, write_fd, image, flags, threads)
+            finally:
+                os.close(write_fd)
+                pump.join()
+            pump.raise_pending()
+
+        if ret:
+            raise WimException(ret)
+
+
+    def _auto_threads(self, flags):
+        """ Thread count for threads="auto". For internal use. """
+        from wimlib import compression, tuning
+        if flags & WRITE_FLAG_SOLID:
+            ctype = self._output_pack_compression_type
+            if ctype is None:
+                ctype = compression.COMPRESSION_TYPE_LZMS
+            return tuning.auto_threads(ctype, solid=True)
+        ctype = self._output_compression_type
+        if ctype is None:
+            ctype = self.info.compression_type[0]
+        return tuning.auto_threads(ctype)
+
+
+    def write_async(self, *args, **kwargs):
+        """ Like WimFile.write, returns a wimlib.aio.Operation to await """
+        from wimlib import aio
+        return aio.write(self, *args, **kwargs)
+
+
     def reference_resources(self, resource, ref_flags, wim_flags):
         """ Reference sources in other WIMs """
         # Filter resources into groups of files and wim objects
@@ -104,18 +228,24 @@ class WimFile(object):
         if (ret := _lib.wimlib_reference_template_image(self._wim_struct,
                      new_index, template_wim._wim_struct, int(template_image), flags)):
             raise WimException(ret)
+        self._invalidate()
 
 
     @property
     def info(self):
-        """ Get information about this WIM """
+        """ Get information about this WIM (a copy of the cached struct, safe to modify) """
+        wim_info = self._cached("info", self._load_info)
+        return WimInfo(_ffi.new("struct wimlib_wim_info*", wim_info[0]))
+
+
+    def _load_info(self):
         wim_info = _ffi.new("struct wimlib_wim_info*")
 
         if (ret := _lib.wimlib_get_wim_info(self._wim_struct, wim_info)):
             raise WimException(ret)
 
         logging.debug(f"Fetched wim_info for {self._wim_struct} from backend.")
-        return WimInfo(wim_info)
+        return wim_info
 
 
     @info.setter
@@ -125,11 +255,16 @@ class WimFile(object):
 
         if (ret := _lib.wimlib_set_wim_info(self._wim_struct, value._info_struct)):
             raise WimException(ret)
+        self._invalidate()
 
 
     @property
-    def xml_data(self, buffer_size=4096):
+    def xml_data(self):
         """ Get the XML data from the file """
+        return self._cached("xml_data", self._load_xml_data)
+
+
+    def _load_xml_data(self):
         out_buffer = _ffi.new("void**")
         out_size = _ffi.new("size_t*")
         if (ret := _lib.wimlib_get_xml_data(self._wim_struct, out_buffer, out_size)):
@@ -138,20 +273,144 @@ class WimFile(object):
         return bytes(_ffi.buffer(_ffi.cast("char*", out_buffer[0]), out_size[0]))
 
 
+    @property
+    def xml(self):
+        """ The XML data parsed into a WimXml (once, cached until the WIM changes) """
+        return self._cached("xml", lambda: WimXml.parse(self.xml_data))
+
+
     def extract_xml_data(self, file):
         raise NotImplementedError("Error: wimlib FILE* argument not supported.")
 
 
-    def register_progress_funcion(self, callback, context):
-        # TODO: Something?
-        pass
+    def register_progress_function(self, callback, context=None, max_rate=None):
+        """ Register callback(event, context) for progress of later operations on this
+            WIM (write, overwrite, extract, verify...); None unregisters it. """
+        self._set_progress_dispatcher(ProgressDispatcher(callback, context, max_rate) if callback else None)
+
+
+    def _set_progress_dispatcher(self, dispatcher):
+        """ Register a ProgressDispatcher (or None). For internal use. """
+        # Keep the dispatcher (and its handle) alive while it is registered
+        self._progress = dispatcher
+        if dispatcher is None:
+            _lib.wimlib_register_progress_function(self._wim_struct, _ffi.NULL, _ffi.NULL)
+        else:
+            _lib.wimlib_register_progress_function(self._wim_struct, dispatcher.c_callback, dispatcher.c_context)
 
 
-    def verify(self, flags):
-        if (ret := _lib.wimlib_verify_wim(self._wim_struct, flags)):
+    register_progress_funcion = register_progress_function
+
+
+    @contextlib.contextmanager
+    def _temporary_progress(self, dispatcher):
+        """ Register dispatcher for the duration of a with block. For internal use. """
+        previous = self._progress
+        self._set_progress_dispatcher(dispatcher)
+        try:
+            yield dispatcher
+        finally:
+            self._set_progress_dispatcher(previous)
+
+
+    def verify(self, flags=0, progress=None, context=None, max_rate=None):
+        """ Verify the WIM: every blob is read and checked against its SHA-1. progress(event,
+            context) receives the PROGRESS_MSG_BEGIN/END_VERIFY_IMAGE and VERIFY_STREAMS events
+            (see wimlib.verify to verify many WIMs in parallel) """
+        if progress:
+            dispatcher = ProgressDispatcher(progress, context, max_rate)
+            with self._temporary_progress(dispatcher):
+                ret = _lib.wimlib_verify_wim(self._wim_struct, flags)
+            dispatcher.raise_pending()
+        else:
+            ret = _lib.wimlib_verify_wim(self._wim_struct, flags)
+        if ret:
             raise WimException(ret)
 
 
+    def verify_async(self, flags=0, **kwargs):
+        """ Like WimFile.verify, returns a wimlib.aio.Operation to await """
+        from wimlib import aio
+        return aio.verify(self, flags, **kwargs)
+
+
+    def extract_many(self, jobs, workers=None, per_disk=1, raise_errors=True):
+        """ Extract several images concurrently. jobs are (image, target, flags) tuples, image an
+            index, name or Image. Every worker thread opens its own WIMStruct of the WIM file
+            (so unsaved changes are not seen). The largest images start first, and at most
+            per_disk extractions (None for no limit) run at once on each spinning disk
+            holding the WIM or a target. Returns an ExtractResult per job, in order; with
+            raise_errors the first error is raised once all the jobs have finished. """
+        from wimlib import tuning
+
+        if not self.path:
+            raise WimException("No path / file to extract from.")
+        jobs = [ExtractResult(self._resolve_image(image), os.fspath(target), flags, None, None)
+                for image, target, flags in jobs]
+        if workers is None:
+            workers = min(len(jobs), tuning.available_cpus())
+
+        def job_disks(job):
+            if per_disk is None:
+                return []
+            devices = {tuning.device_of(self.path), tuning.device_of(job.target)}
+            return [dev for dev in devices if tuning.is_rotational(dev)]
+
+        disks = [job_disks(job) for job in jobs]
+        sizes = [self.images[job.image].size or 0 for job in jobs]
+        queue = sorted(range(len(jobs)), key=lambda i: -sizes[i])
+        busy = collections.Counter()
+        local = threading.local()
+        handles = []
+
+        def run(job):
+            if (wim := getattr(local, "wim", None)) is None:
+                wim = local.wim = WimFile.from_file(self.path)
+                handles.append(wim)
+            start = time.perf_counter()
+            try:
+                wim.images[job.image].extract(job.target, job.flags)
+            except Exception as ex:
+                return job._replace(seconds=time.perf_counter() - start, error=ex)
+            return job._replace(seconds=time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max(1, workers), thread_name_prefix="wimlib-extract") as executor:
+            running = {}
+            while queue or running:
+                # Start the largest jobs whose disks have a free slot
+                for i in list(queue):
+                    if len(running) >= workers:
+                        break
+                    if all(busy[dev] < per_disk for dev in disks[i]):
+                        queue.remove(i)
+                        busy.update(disks[i])
+                        running[executor.submit(run, jobs[i])] = i
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    busy.subtract(disks[i])
+                    jobs[i] = future.result()
+        handles.clear()
+
+        logging.debug(f"Extracted {len(jobs)} images with {workers} workers.")
+        if raise_errors:
+            for job in jobs:
+                if job.error is not None:
+                    raise job.error
+        return jobs
+
+
+    def _resolve_image(self, image):
+        """ Index of an image given as index, name or Image. For internal use. """
+        if isinstance(image, Image):
+            return image.index
+        if isinstance(image, int):
+            return image
+        if not (index := self.images.resolve(str(image).encode())):
+            raise WimException(f"No image {image!r} in {self.path}.")
+        return index
+
+
     def split(self, name, size, flags):
         if (ret := _lib.wimlib_split(self._wim_struct, name, size, flags)):
             raise WimException(ret)
@@ -160,6 +419,7 @@ class WimFile(object):
     def set_output_pack_compression_type(self, cmp_type):
         if (ret := _lib.wimlib_set_output_pack_compression_type(self._wim_struct, cmp_type)):
             raise WimException(ret)
+        self._output_pack_compression_type = cmp_type
 
 
     def set_output_pack_chunk_size(self, chunk_size):
@@ -170,6 +430,7 @@ class WimFile(object):
     def set_output_compression_type(self, cmp_type):
         if (ret := _lib.wimlib_set_output_compression_type(self._wim_struct, cmp_type)):
             raise WimException(ret)
+        self._output_compression_type = cmp_type
 
 
     def set_output_chunk_size(self, chunk_size):
@@ -177,15 +438,176 @@ class WimFile(object):
             raise WimException(ret)
 
 
-    def iterate_lookup_table(self, flags, callback, context):
-        context = _ffi.new_handle(context)
-
-        @_ffi.callback("int(const struct wimlib_resource_entry, void*)")
-        def __wrapper(resource_entry, user_context):
-            user_context = _ffi.from_handle(user_context)
+    def iterate_lookup_table(self, flags, callback, context=None):
+        def __wrapper(resource_entry):
             # TODO: Cast resource_entry to a pythonic object instead of C struct.
-            ret_val = callback(resource_entry, user_context)
+            ret_val = callback(resource_entry, context)
             return ret_val if ret_val is not None else 0
 
-        if _lib.wimlib_iterate_lookup_table(self._wim_struct, flags, __wrapper, context):
+        self._iterate_lookup_table(flags, __wrapper)
+
+
+    def _iterate_lookup_table(self, flags, func):
+        """ wimlib_iterate_lookup_table calling func(entry) for every entry. For internal use. """
+        callback = _EntryCallback(func)
+        ret = _lib.wimlib_iterate_lookup_table(self._wim_struct, flags, wimlib._backend.callbacks["resource_entry"],
+                                               callback.handle)
+        callback.raise_pending()
+        if ret:
             raise WimException(ret)
+
+
+    def resources(self):
+        """ Get the lookup table as a ResourceTable, cached until the WIM is modified """
+        if self._resources is None:
+            table = ResourceTable()
+            self._iterate_lookup_table(0, table._collector())
+            self._resources = table
+        return self._resources
+
+
+    def open_blob(self, sha1):
+        """ Open the blob with this SHA-1 as a read-only, seekable binary file object
+            reading it straight from the WIM file (see wimlib.blob) """
+        from wimlib import blob
+
+        if not self.path or not os.path.isfile(self.path):
+            raise WimException("No WIM file to read from.")
+        index = self.resources().find(sha1)
+        if index is None:
+            raise WimException(f"No blob with SHA-1 {bytes(sha1).hex()} in {self.path}.")
+        entry = self.resources()[index]
+        info = self.info
+        if info.is_pipeable:
+            raise WimException("Blobs of pipable WIMs can't be read in place.")
+        # Blobs added since the WIM was written have no location in the file yet
+        stored_size = (entry.raw_resource_compressed_size if entry.flags & ResourceTable.FLAG_PACKED
+                       else entry.compressed_size)
+        if entry.uncompressed_size and not stored_size:
+            raise WimException(f"Blob {bytes(sha1).hex()} is not written to {self.path}.")
+        if entry.part_number != info.part_number:
+            raise WimException(f"Blob {bytes(sha1).hex()} is in part {entry.part_number} of the split WIM.")
+        if self._data is None:
+            self._data = blob.WimData(self.path, info.compression_type[0], info.chunk_size)
+        return self._data.open(entry)
+
+
+ExtractResult = collections.namedtuple("ExtractResult", ("image", "target", "flags", "seconds", "error"))
+
+
+ResourceEntry = collections.namedtuple("ResourceEntry", (
+    "sha1", "uncompressed_size", "compressed_size", "offset", "part_number", "reference_count",
+    "flags", "raw_resource_offset", "raw_resource_compressed_size", "raw_resource_uncompressed_size"))
+
+
+class ResourceTable(object):
+    """
+    Columnar copy of the lookup table of a WIM, returned by WimFile.resources().
+
+    Blob i is described by item i of every column; hashes holds the 20 byte
+    SHA-1 of every blob back to back and flags the RESOURCE_FLAG_* bits.
+    """
+    FLAG_COMPRESSED = 0x01
+    FLAG_METADATA =   0x02
+    FLAG_FREE =       0x04
+    FLAG_SPANNED =    0x08
+    FLAG_MISSING =    0x10
+    FLAG_PACKED =     0x20
+
+    def __init__(self):
+        self.uncompressed_sizes = array("Q")
+        self.compressed_sizes = array("Q")
+        self.offsets = array("Q")
+        self.part_numbers = array("I")
+        self.reference_counts = array("I")
+        self.flags = array("I")
+        self.raw_resource_offsets = array("Q")
+        self.raw_resource_compressed_sizes = array("Q")
+        self.raw_resource_uncompressed_sizes = array("Q")
+        self.hashes = bytearray()
+        self._by_sha1 = None
+
+
+    def _collector(self):
+        """ Build the wimlib_iterate_lookup_table callback filling the columns. For internal use. """
+        buffer = _ffi.buffer
+
+        def collect(entry):
+            self.hashes += buffer(entry.sha1_hash)
+            self.uncompressed_sizes.append(entry.uncompressed_size)
+            self.compressed_sizes.append(entry.compressed_size)
+            self.offsets.append(entry.offset)
+            self.part_numbers.append(entry.part_number)
+            self.reference_counts.append(entry.reference_count)
+            self.flags.append(entry.is_compressed | entry.is_metadata << 1 | entry.is_free << 2 |
+                              entry.is_spanned << 3 | entry.is_missing << 4 | entry.packed << 5)
+            self.raw_resource_offsets.append(entry.raw_resource_offset_in_wim)
+            self.raw_resource_compressed_sizes.append(entry.raw_resource_compressed_size)
+            self.raw_resource_uncompressed_sizes.append(entry.raw_resource_uncompressed_size)
+            return 0
+        return collect
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    def __getitem__(self, index):
+        return ResourceEntry(self.sha1(index), self.uncompressed_sizes[index], self.compressed_sizes[index],
+                             self.offsets[index], self.part_numbers[index], self.reference_counts[index],
+                             self.flags[index], self.raw_resource_offsets[index],
+                             self.raw_resource_compressed_sizes[index], self.raw_resource_uncompressed_sizes[index])
+
+
+    def sha1(self, index):
+        return bytes(self.hashes[index * 20:(index + 1) * 20])
+
+
+    def find(self, sha1):
+        """ Index of the blob with this SHA-1, None if there is none """
+        if self._by_sha1 is None:
+            self._by_sha1 = {self.sha1(i): i for i in range(len(self))}
+        return self._by_sha1.get(bytes(sha1))
+
+
+    def stored_size(self, index):
+        """ Bytes the blob takes in the WIM; for blobs packed in a solid resource, its
+            share of the resource in proportion to its uncompressed size """
+        if self.flags[index] & self.FLAG_PACKED:
+            raw_uncompressed = self.raw_resource_uncompressed_sizes[index]
+            if not raw_uncompressed:
+                return 0
+            return self.uncompressed_sizes[index] * self.raw_resource_compressed_sizes[index] // raw_uncompressed
+        return self.compressed_sizes[index]
+
+
+    def _data_blobs(self):
+        return (i for i in range(len(self)) if not self.flags[i] & self.FLAG_METADATA)
+
+
+    def dedup_ratio(self):
+        """ Bytes referenced by all images over the bytes stored once (metadata excluded) """
+        unique = referenced = 0
+        for i in self._data_blobs():
+            unique += self.uncompressed_sizes[i]
+            referenced += self.uncompressed_sizes[i] * self.reference_counts[i]
+        return referenced / unique if unique else 1.0
+
+
+    def largest(self, count=10):
+        """ The count largest data blobs by uncompressed size, as ResourceEntry tuples """
+        indexes = heapq.nlargest(count, self._data_blobs(), key=self.uncompressed_sizes.__getitem__)
+        return [self[i] for i in indexes]
+
+
+    def image_sizes(self, images):
+        """ {image index: (uncompressed bytes, stored bytes)} of the distinct blobs each
+            of images (Image objects, e.g. wim.images.values()) references """
+        sizes = {}
+        for image in images:
+            tree = image.scan_tree("/")
+            blobs = {self.find(tree.sha1(i)) for i in range(len(tree)) if tree.sizes[i]}
+            blobs.discard(None)
+            sizes[image.index] = (sum(self.uncompressed_sizes[i] for i in blobs),
+                                  sum(self.stored_size(i) for i in blobs))
+        return sizes
@@ -1,9 +1,21 @@
+import collections
 import logging
+import os
+import threading
 
 import wimlib
-from wimlib import _lib, _ffi, WimException
+from wimlib import _lib, _ffi, WimException, pipe
+from wimlib.errors import ERR_ABORTED_BY_PROGRESS
+from wimlib.progress import ProgressDispatcher
+from array import array
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 import subprocess
+import sys
+
+# Image specification consts (NO_IMAGE is the index of deleted Image objects)
+NO_IMAGE =                       0
+ALL_IMAGES =                     -1
 
 # Mount flags
 MOUNT_READWRITE =                0x00000001
@@ -21,6 +33,65 @@ UNMOUNT_RECOMPRESS =             0x00000008
 UNMOUNT_FORCE =                  0x00000010
 UNMOUNT_NEW_IMAGE =              0x00000020
 
+# Iterate dir tree flags
+ITERATE_DIR_TREE_FLAG_RECURSIVE =        0x00000001
+ITERATE_DIR_TREE_FLAG_CHILDREN =         0x00000002
+ITERATE_DIR_TREE_FLAG_RESOURCES_NEEDED = 0x00000004
+
+FILE_ATTRIBUTE_DIRECTORY =       0x00000010
+
+# Add flags (AddCommand, ImageCollection.add, Image.add_tree)
+ADD_FLAG_NTFS =                  0x00000001
+ADD_FLAG_DEREFERENCE =           0x00000002
+ADD_FLAG_VERBOSE =               0x00000004
+ADD_FLAG_BOOT =                  0x00000008
+ADD_FLAG_UNIX_DATA =             0x00000010
+ADD_FLAG_NO_ACLS =               0x00000020
+ADD_FLAG_STRICT_ACLS =           0x00000040
+ADD_FLAG_EXCLUDE_VERBOSE =       0x00000080
+ADD_FLAG_RPFIX =                 0x00000100
+ADD_FLAG_NORPFIX =               0x00000200
+ADD_FLAG_NO_UNSUPPORTED_EXCLUDE = 0x00000400
+ADD_FLAG_WINCONFIG =             0x00000800
+ADD_FLAG_WIMBOOT =               0x00001000
+ADD_FLAG_NO_REPLACE =            0x00002000
+
+# Delete flags (DeleteCommand, Image.delete_path)
+DELETE_FLAG_FORCE =              0x00000001
+DELETE_FLAG_RECURSIVE =          0x00000002
+
+# Update flags
+UPDATE_FLAG_SEND_PROGRESS =      0x00000001
+
+# enum wimlib_update_op
+UPDATE_OP_ADD =                  0
+UPDATE_OP_DELETE =               1
+UPDATE_OP_RENAME =               2
+
+# Extract flags
+EXTRACT_FLAG_NTFS =                       0x00000001
+EXTRACT_FLAG_RECOVER_DATA =               0x00000002
+EXTRACT_FLAG_UNIX_DATA =                  0x00000020
+EXTRACT_FLAG_NO_ACLS =                    0x00000040
+EXTRACT_FLAG_STRICT_ACLS =                0x00000080
+EXTRACT_FLAG_RPFIX =                      0x00000100
+EXTRACT_FLAG_NORPFIX =                    0x00000200
+EXTRACT_FLAG_TO_STDOUT =                  0x00000400
+EXTRACT_FLAG_REPLACE_INVALID_FILENAMES =  0x00000800
+EXTRACT_FLAG_ALL_CASE_CONFLICTS =         0x00001000
+EXTRACT_FLAG_STRICT_TIMESTAMPS =          0x00002000
+EXTRACT_FLAG_STRICT_SHORT_NAMES =         0x00004000
+EXTRACT_FLAG_STRICT_SYMLINKS =            0x00008000
+EXTRACT_FLAG_GLOB_PATHS =                 0x00040000
+EXTRACT_FLAG_STRICT_GLOB =                0x00080000
+EXTRACT_FLAG_NO_ATTRIBUTES =              0x00100000
+EXTRACT_FLAG_NO_PRESERVE_DIR_STRUCTURE =  0x00200000
+EXTRACT_FLAG_WIMBOOT =                    0x00400000
+EXTRACT_FLAG_COMPACT_XPRESS4K =           0x01000000
+EXTRACT_FLAG_COMPACT_XPRESS8K =           0x02000000
+EXTRACT_FLAG_COMPACT_XPRESS16K =          0x04000000
+EXTRACT_FLAG_COMPACT_LZX =                0x08000000
+
 
 class ImageCollection(object):
     """
@@ -52,40 +123,66 @@ class ImageCollection(object):
 
 
     def refresh(self, return_last=False):
-        """ Refresh the objects image list """
-        logging.debug(f"Refreshing image collection for {self._wim_obj}.")
-        logging.debug(f"WimFile Info: {self._wim_obj.info}")
-        logging.debug(f"Image Count: {self._wim_obj.info.image_count}")
-
-        for index in range(1, self._wim_obj.info.image_count + 1):
-            logging.debug(f"Refreshing image {index}")
+        """ Bring the image list up to date with the WIM: Image objects are added for new
+            indexes and dropped past the image count, existing ones are kept """
+        image_count = self._wim_obj.info.image_count
+        known = len(self.images)
+        if image_count != known:
+            logging.debug(f"Refreshing image collection for {self._wim_obj}: {known} -> {image_count} images.")
+        for index in range(known + 1, image_count + 1):
             self.images[index] = Image(index, self._wim_obj)
+        for index in range(image_count + 1, known + 1):
+            del self.images[index]
         if return_last:
-            logging.debug(f"Returning last image ({max(self.images, key=int)}).")
-            return self.images[max(self.images, key=int)]
+            return self.images.get(image_count)
 
 
     def add_empty(self, name=""):
         """ Add an empty image """
-        ret = _lib.wimlib_add_empty_image(
-            self._wim_struct, name, _ffi.NULL)
-        if ret:
+        keep_alive = []
+        new_index = _ffi.new("int*")
+        if (ret := _lib.wimlib_add_empty_image(self._wim_struct, _new_tchar(name, keep_alive), new_index)):
             raise WimException(ret)
-        return self.refresh(True)
+        self._wim_obj._invalidate()
+        image = self.images[new_index[0]] = Image(new_index[0], self._wim_obj)
+        return image
 
 
     def add(self, source, name="", config="", flags=0):
         """ Add image from filesystem path """
         ret = _lib.wimlib_add_image(
             self._wim_struct, source, name, config, flags)
+        self._wim_obj._invalidate()
         if ret:
             raise WimException(ret)
         return self.refresh(True)
 
 
-    def add_multisource():
-        """ Add image from multiple filesystem paths """
-        raise NotImplementedError()
+    def add_async(self, source, name="", config="", flags=0, **kwargs):
+        """ Like ImageCollection.add, returns a wimlib.aio.Operation to await """
+        from wimlib import aio
+        return aio.add(self, source, name, config, flags, **kwargs)
+
+
+    def add_multisource(self, sources, name="", config=None, flags=0, prescan=None, workers=None):
+        """ Add image from multiple filesystem paths; sources is a list of (fs_path, wim_target)
+            pairs. If prescan is given, the sources are scanned first (see prescan_sources)
+            and prescan(result) is called before the capture starts. """
+        sources = [(str(fs_path), wim_target) for fs_path, wim_target in sources]
+        if prescan:
+            prescan(prescan_sources(sources, workers))
+
+        c_sources = _ffi.new("struct wimlib_capture_source[]", len(sources))
+        keep_alive = []
+        for (fs_path, wim_target), c_source in zip(sources, c_sources):
+            c_source.fs_source_path = _new_tchar(fs_path, keep_alive)
+            c_source.wim_target_path = _new_tchar(wim_target, keep_alive)
+        ret = _lib.wimlib_add_image_multisource(self._wim_struct, c_sources, len(sources),
+                                                _new_tchar(name, keep_alive), _new_tchar(config, keep_alive), flags)
+        self._wim_obj._invalidate()
+        if ret:
+            raise WimException(ret)
+        return self.refresh(True)
 
 
     def delete(self, image):
@@ -98,6 +195,18 @@ class ImageCollection(object):
         ret = _lib.wimlib_delete_image(self._wim_struct, image)
         if ret:
             raise WimException(ret)
+        self._wim_obj._invalidate()
+
+        if image == ALL_IMAGES:
+            for deleted in self.images.values():
+                deleted.index = NO_IMAGE
+            self.images.clear()
+            return
+        self.images.pop(image).index = NO_IMAGE
+        # The later images move down one index; their Image objects follow them
+        for index in range(image + 1, len(self.images) + 2):
+            moved = self.images[index - 1] = self.images.pop(index)
+            moved.index = index - 1
 
 
     def is_name_in_use(self, name):
@@ -123,6 +232,65 @@ class ImageCollection(object):
         return self.images.items()
 
 
+SourceScan = collections.namedtuple("SourceScan", ("path", "files", "directories", "bytes"))
+PrescanResult = collections.namedtuple("PrescanResult", ("files", "directories", "bytes", "sources"))
+
+
+def _scan_directory(path):
+    """ Count the files, directories and file bytes under path (not following symlinks)
+        without descending into subdirectories, returns (files, dirs, bytes, subdirs) """
+    files = directories = size = 0
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories += 1
+                    subdirs.append(entry.path)
+                else:
+                    files += 1
+                    size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return files, directories, size, subdirs
+
+
+def prescan_sources(sources, workers=None):
+    """ Stat capture sources ((fs_path, wim_target) pairs or paths) in parallel threads.
+        Returns a PrescanResult with the totals and a SourceScan per source, to
+        estimate the cost of a capture before running it. """
+    paths = [str(source[0] if isinstance(source, (tuple, list)) else source) for source in sources]
+    totals = {path: [0, 0, 0] for path in paths}
+    with ThreadPoolExecutor(workers) as executor:
+        pending = {}
+        for path in paths:
+            if os.path.isdir(path):
+                totals[path][1] += 1
+                pending[executor.submit(_scan_directory, path)] = path
+            else:
+                totals[path][0] += 1
+                totals[path][2] += os.lstat(path).st_size
+        # Every directory is a task, so large trees spread over the workers
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    files, directories, size, subdirs = future.result()
+                except OSError:
+                    continue
+                total = totals[path]
+                total[0] += files
+                total[1] += directories
+                total[2] += size
+                for subdir in subdirs:
+                    pending[executor.submit(_scan_directory, subdir)] = path
+
+    scans = [SourceScan(path, *totals[path]) for path in paths]
+    return PrescanResult(sum(scan.files for scan in scans), sum(scan.directories for scan in scans),
+                         sum(scan.bytes for scan in scans), scans)
+
+
 class Image(object):
     """
     This class represents an image inside a WIM file.
@@ -155,9 +323,11 @@ class Image(object):
 
     @property
     def name(self):
-        """ Get the name of the image """
-        value = _lib.wimlib_get_image_name(self._wim_struct, self.index)
-        return _ffi.string(value) if value else ""
+        """ Get the name of the image (cached until the WIM changes) """
+        def load():
+            value = _lib.wimlib_get_image_name(self._wim_struct, self.index)
+            return _ffi.string(value) if value else ""
+        return self._wim_obj._cached(("name", self.index), load)
 
 
     @name.setter
@@ -165,54 +335,79 @@ class Image(object):
         """ Set the name of the image """
         ret = _lib.wimlib_set_image_name(
             self._wim_struct, self.index, value)
+        self._wim_obj._invalidate()
         if ret:
             raise WimException(ret)
 
 
     @property
     def description(self):
-        """ Get the description of the image """
-        value = _lib.wimlib_get_image_description(self._wim_struct, self.index)
-        return _ffi.string(value) if value else ""
+        """ Get the description of the image (cached until the WIM changes) """
+        def load():
+            value = _lib.wimlib_get_image_description(self._wim_struct, self.index)
+            return _ffi.string(value) if value else ""
+        return self._wim_obj._cached(("description", self.index), load)
 
 
     @description.setter
     def description(self, val):
         """ Set the description of the image """
-        if (ret := _lib.wimlib_set_image_descripton(self._wim_struct, self.index, val)):
+        ret = _lib.wimlib_set_image_descripton(self._wim_struct, self.index, val)
+        self._wim_obj._invalidate()
+        if ret:
             raise WimException(ret)
 
 
     @property
     def size(self):
-        """ Get the size of the image """
+        """ Get the size of the image, -1 if unknown """
         try:
-          return int(self.get_property("TOTALBYTES"))
-        except:
-          -1
+            return int(self.get_property("TOTALBYTES"))
+        except ValueError:
+            return -1
 
 
     @size.setter
     def size(self, value):
         """ Set the size of the image """
-        self.set_property(self, "TOTALBYTES", value)
+        self.set_property("TOTALBYTES", str(value).encode())
 
 
     def get_property(self, name):
-        """ Get a property from the XML metadata for the image """
-        val = _lib.wimlib_get_image_property(self._wim_struct, self.index, str(name).encode())
-        return _ffi.string(val) if val else ""
+        """ Get a property from the XML metadata for the image (cached until the WIM changes) """
+        name = str(name)
+        def load():
+            val = _lib.wimlib_get_image_property(self._wim_struct, self.index, name.encode())
+            return _ffi.string(val) if val else ""
+        return self._wim_obj._cached(("property", self.index, name), load)
+
+
+    @property
+    def properties(self):
+        """ All the properties of the image in the XML data as a {name: value} dict, names
+            and values as for get_property ("WINDOWS/VERSION/MAJOR": b"10"), from the
+            parsed WimFile.xml """
+        properties = self._wim_obj.xml.images.get(self.index, {})
+        if wimlib._backend.os_family == "Windows":
+            # wimlib_tchar strings are str there
+            return dict(properties)
+        encoding = wimlib._backend.encoding
+        return {name: value.encode(encoding) for name, value in properties.items()}
 
 
     def set_property(self, name, val):
         """ Set a property in the XML metadata for the image """
-        if (ret := _lib.wimlib_set_image_property(self._wim_struct, self.index, str(name).encode(), val)):
+        ret = _lib.wimlib_set_image_property(self._wim_struct, self.index, str(name).encode(), val)
+        self._wim_obj._invalidate()
+        if ret:
             raise WimException(ret)
 
 
     def set_flags(self, flags):
         """ Set the FLAGS property in the XML metadata. This is like Image.set_property("FLAGS", value) """
-        if (ret := _lib.wimlib_set_image_flags(self._wim_struct, self.index, flags)):
+        ret = _lib.wimlib_set_image_flags(self._wim_struct, self.index, flags)
+        self._wim_obj._invalidate()
+        if ret:
             raise WimException(ret)
 
 
@@ -254,35 +449,36 @@ class Image(object):
         self.mounts.append(mount)
 
 
-    def unmount(self, mount, flags=0, progress_func=None, progress_context=None):
-        """ Unmount the mounted image in the specified directory. """
+    def unmount(self, mount, flags=0, progress_func=None, progress_context=None, max_rate=None):
+        """ Unmount the mounted image in the specified directory.
+            progress_func(event, context) receives ProgressEvent objects. """
         mount = str(mount).encode()
 
         if not progress_func:
             if (ret := _lib.wimlib_unmount_image(mount, flags)):
                 raise WimException(ret)
         else:
-            self._unmount_with_progress(mount, flags, callback, context)
+            self._unmount_with_progress(mount, flags, progress_func, progress_context, max_rate)
 
+        if flags & UNMOUNT_COMMIT:
+            self._wim_obj._invalidate()
         self.mounts.remove(mount)
 
 
-    def _unmount_with_progress(self, mount, flags, callback, context=None):
+    def _unmount_with_progress(self, mount, flags, callback, context=None, max_rate=None):
         """ Like Image.unmount just with a progress function, For internal use only. """
-        @_ffi.callback("enum wimlib_progress_status(enum wimlib_progress_msg, union wimlib_progress_info*, void*)")
-        def __wrapper(progress_msg, progress_info, user_context):
-            user_context = _ffi.from_handle(user_context)
-            # TODO: Cast progress_info to a pythonic object instead of C union.
-            ret_val = callback(progress_msg, progress_info, user_context)
-            return ret_val if ret_val is not None else 0
-        context = _ffi.new_handle(context)
-        if (ret := _lib.wimlib_unmount_image_with_progress(mount, flags, __wrapper, context)):
+        dispatcher = ProgressDispatcher(callback, context, max_rate)
+        ret = _lib.wimlib_unmount_image_with_progress(mount, flags, dispatcher.c_callback, dispatcher.c_context)
+        dispatcher.raise_pending()
+        if ret:
             raise WimException(ret)
 
 
     def add_tree(self, source, target, flags):
         """ Add content to the image from the local filesystem """
-        if (ret := _lib.wimlib_add_tree(self._wim_struct, self.index, source, target, flags)):
+        ret = _lib.wimlib_add_tree(self._wim_struct, self.index, source, target, flags)
+        self._wim_obj._invalidate()
+        if ret:
             raise WimException(ret)
 
 
@@ -290,45 +486,98 @@ class Image(object):
         """ Rename a pah inside the image """
         if (ret := _lib.wimlib_rename_path(self._wim_struct, self.index, source, target)):
             raise WimException(ret)
+        self._wim_obj._invalidate()
 
 
     def delete_path(self, path, flags):
         """ Delete a path inside the image """
         if (ret := _lib.wimlib_delete_path(self._wim_struct, self.index, path, flags)):
             raise WimException(ret)
+        self._wim_obj._invalidate()
 
 
     def iterate_dir_tree(self, path, flags, callback, context=None):
         """ Iterate over the files/directories in the image """
-        @_ffi.callback("int(struct wimlib_dir_entry*, void*)")
-        def __wrapper(dir_entry, user_context):
-            user_context = _ffi.from_handle(user_context)
+        def __wrapper(dir_entry):
             py_dentry = DirEntry(dir_entry)
             # TODO: Cast dir_entry into a more pythonic object instead of C struct.
-            ret_val = callback(py_dentry, user_context)
+            ret_val = callback(py_dentry, context)
             return ret_val if ret_val is not None else 0
-        context = _ffi.new_handle(context)
-        if (ret := _lib.wimlib_iterate_dir_tree(self._wim_struct, self.index, path, flags, __wrapper, context)):
-            raise WimException(ret)
-
+        _iterate_dir_tree(self._wim_struct, self.index, path, flags, __wrapper)
+
+
+    def scan_tree(self, path="/", recursive=True):
+        """ Collect the dentries under path (path itself included when recursive)
+            into a columnar DirTree, in one wimlib_iterate_dir_tree pass """
+        path = path.encode() if isinstance(path, str) else path
+        flags = ITERATE_DIR_TREE_FLAG_RECURSIVE if recursive else ITERATE_DIR_TREE_FLAG_CHILDREN
+        tree = DirTree()
+        _iterate_dir_tree(self._wim_struct, self.index, path, flags, tree._collector())
+        return tree
+
+
+    def open(self, path):
+        """ Open the file at path in the image as a read-only, seekable binary file object
+            reading its data straight from the WIM's resources, without extracting it """
+        from wimlib.blob import BlobReader
+
+        tree = DirTree()
+        path = path.encode(wimlib._backend.encoding) if isinstance(path, str) else path
+        _iterate_dir_tree(self._wim_struct, self.index, path, 0, tree._collector())
+        if tree.is_directory(0):
+            raise IsADirectoryError(f"{tree.paths[0]} is a directory.")
+        sha1 = tree.sha1(0)
+        if not tree.sizes[0] or not any(sha1):
+            return BlobReader(None, 0, 0)
+        return self._wim_obj.open_blob(sha1)
+
+
+    def update(self, commands, flags=0, progress=None, context=None, max_rate=None):
+        """ Execute a list of AddCommand / DeleteCommand / RenameCommand in one
+            wimlib_update_image call. progress(event, context) receives the
+            PROGRESS_MSG_UPDATE_BEGIN/END_COMMAND events (and those of the adds);
+            on UPDATE_BEGIN_COMMAND the command is commands[event.completed_commands]. """
+        commands = list(commands)
+        c_commands = _ffi.new("struct wimlib_update_command[]", len(commands))
+        # The strings must outlive the call
+        keep_alive = []
+        for command, c_command in zip(commands, c_commands):
+            command._fill(c_command, keep_alive)
+
+        if progress:
+            flags |= UPDATE_FLAG_SEND_PROGRESS
+            dispatcher = ProgressDispatcher(progress, context, max_rate)
+            with self._wim_obj._temporary_progress(dispatcher):
+                ret = _lib.wimlib_update_image(self._wim_struct, self.index, c_commands, len(commands), flags)
+            dispatcher.raise_pending()
+        else:
+            ret = _lib.wimlib_update_image(self._wim_struct, self.index, c_commands, len(commands), flags)
 
-    def update(self, commands, flags):
-        """ Execute multiple update commands on the image """
-        raise NotImplementedError()
+        self._wim_obj._invalidate()
+        if ret:
+            raise WimException(ret)
 
 
-    def extract(self, target, flags):
+    def extract(self, target, flags=0):
         """ Extract the image to the specified directory or unmounted NTFS volume """
-        if (ret := _lib.wimlib_extract_image(self._wim_struct, self.index, target, flags)):
+        keep_alive = []
+        if (ret := _lib.wimlib_extract_image(self._wim_struct, self.index, _new_tchar(os.fspath(target), keep_alive),
+                                             flags)):
             raise WimException(ret)
 
 
-    # TODO: Add wimlib_extract_image_from_pipe and wimlib_extract_image_from_pipe_with_progress
-    def extract_paths(self, target, paths, flags):
-        """ Extract a list of paths from the image """
-        paths = [_ffi.new("char[]", path) for path in paths]
-        paths_array = _ffi.new("char*[]", paths)
-        if (ret := _lib.wimlib_extract_paths(self._wim_struct, self.index, target, paths_array, len(paths), flags)):
+    def extract_async(self, target, flags=0, **kwargs):
+        """ Like Image.extract, returns a wimlib.aio.Operation to await """
+        from wimlib import aio
+        return aio.extract(self, target, flags, **kwargs)
+
+
+    def extract_paths(self, target, paths, flags=0):
+        """ Extract a list of paths from the image (see ExtractionPlan to batch many requests) """
+        keep_alive = []
+        paths_array = _ffi.new("wimlib_tchar *[]", [_new_tchar(path, keep_alive) for path in paths])
+        if (ret := _lib.wimlib_extract_paths(self._wim_struct, self.index, _new_tchar(os.fspath(target), keep_alive),
+                                             paths_array, len(paths_array), flags)):
             raise WimException(ret)
 
 
@@ -350,8 +599,144 @@ class Image(object):
         if (ret := _lib.wimlib_export_image(self._wim_struct, self.index,
                                       ex_target._wim_struct, ex_name, ex_desc, flags)):
             raise WimException(ret)
+        ex_target._invalidate()
+        ex_target.images.refresh()
+
+
+def extract_from_stream(fileobj, image, target, flags=0, progress=None, context=None, max_rate=None,
+                        buffer_size=pipe.BUFFER_SIZE):
+    """ Extract an image (1-based index or name) of a pipable WIM read from fileobj to target,
+        as the data arrives. fileobj is an fd, a socket, or any object with a readinto() or
+        read() method (an HTTP response, a gzip or buffered file...). libwim reads fds,
+        plain sockets and unbuffered files (io.FileIO) directly; other objects are fed
+        through a pipe by a pump thread. progress(event, context) receives ProgressEvent
+        objects, at most max_rate per second for high frequency messages. """
+    keep_alive = []
+    image = _new_tchar(str(image), keep_alive)
+    target = _new_tchar(os.fspath(target), keep_alive)
+    dispatcher = ProgressDispatcher(progress, context, max_rate) if progress else None
+
+    def extract(fd):
+        if dispatcher is None:
+            return _lib.wimlib_extract_image_from_pipe(fd, image, target, flags)
+        return _lib.wimlib_extract_image_from_pipe_with_progress(fd, image, target, flags,
+                                                                 dispatcher.c_callback, dispatcher.c_context)
+
+    fd = pipe.get_fileno(fileobj)
+    if fd is not None:
+        ret = extract(fd)
+    else:
+        read_fd, write_fd = os.pipe()
+        pipe.grow(write_fd, buffer_size)
+        pump = pipe.PipeFeed(write_fd, fileobj, buffer_size)
+        pump.start()
+        try:
+            ret = extract(read_fd)
+        finally:
+            # Unblocks the pump with EPIPE if libwim stopped reading early
+            os.close(read_fd)
+            pump.join()
+        # A failed read of fileobj is the cause of the truncated WIM libwim saw
+        if not isinstance(pump.exception, BrokenPipeError):
+            pump.raise_pending()
+
+    if dispatcher is not None:
+        dispatcher.raise_pending()
+    if ret:
+        raise WimException(ret)
+
+
+class _EntryCallback(object):
+    """ Context of the dir_entry / resource_entry callbacks, calling func(entry). An exception
+        raised by func stops the iteration and is re-raised by raise_pending(). For internal use. """
+    def __init__(self, func):
+        self.func = func
+        self.exception = None
+        self.handle = _ffi.new_handle(self)
+
+    def __call__(self, entry):
+        try:
+            return self.func(entry)
+        except BaseException as ex:
+            self.exception = ex
+            return ERR_ABORTED_BY_PROGRESS
+
+    def raise_pending(self):
+        """ Re-raise an exception raised by func, if any """
+        if self.exception is not None:
+            exception, self.exception = self.exception, None
+            raise exception
+
+
+def _iterate_dir_tree(wim_struct, image, path, flags, func):
+    """ wimlib_iterate_dir_tree calling func(dentry) for every entry. For internal use. """
+    callback = _EntryCallback(func)
+    ret = _lib.wimlib_iterate_dir_tree(wim_struct, image, path, flags, wimlib._backend.callbacks["dir_entry"],
+                                       callback.handle)
+    callback.raise_pending()
+    if ret:
+        raise WimException(ret)
+
 
-        self._wim_obj.images.refresh()
+def _new_tchar(value, keep_alive):
+    """ New wimlib_tchar[] from a str / bytes (NULL for None), appended to keep_alive """
+    if value is None:
+        return _ffi.NULL
+    if isinstance(value, str) and wimlib._backend.os_family != "Windows":
+        value = value.encode(wimlib._backend.encoding)
+    buf = _ffi.new("wimlib_tchar[]", value)
+    keep_alive.append(buf)
+    return buf
+
+
+class AddCommand(object):
+    """ Update command adding the file or directory source (on the local filesystem) at target """
+    __slots__ = ("source", "target", "config", "flags")
+
+    def __init__(self, source, target, config=None, flags=0):
+        self.source = source
+        self.target = target
+        self.config = config
+        self.flags = flags
+
+
+    def _fill(self, c_command, keep_alive):
+        c_command.op = UPDATE_OP_ADD
+        c_command.add.fs_source_path = _new_tchar(str(self.source), keep_alive)
+        c_command.add.wim_target_path = _new_tchar(self.target, keep_alive)
+        c_command.add.config_file = _new_tchar(self.config, keep_alive)
+        c_command.add.add_flags = self.flags
+
+
+class DeleteCommand(object):
+    """ Update command deleting path from the image """
+    __slots__ = ("path", "flags")
+
+    def __init__(self, path, flags=0):
+        self.path = path
+        self.flags = flags
+
+
+    def _fill(self, c_command, keep_alive):
+        c_command.op = UPDATE_OP_DELETE
+        c_command.delete.wim_path = _new_tchar(self.path, keep_alive)
+        c_command.delete.delete_flags = self.flags
+
+
+class RenameCommand(object):
+    """ Update command renaming source to target inside the image """
+    __slots__ = ("source", "target")
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+
+
+    def _fill(self, c_command, keep_alive):
+        c_command.op = UPDATE_OP_RENAME
+        c_command.rename.wim_source_path = _new_tchar(self.source, keep_alive)
+        c_command.rename.wim_target_path = _new_tchar(self.target, keep_alive)
+        c_command.rename.rename_flags = 0
 
 
 class DirEntry(object):
@@ -483,3 +868,237 @@ class DirEntry(object):
     @property
     def streams(self):
         return self._dentry.streams
+
+
+class DirTree(object):
+    """
+    Columnar listing of an image directory tree, built by Image.scan_tree.
+
+    Entry i is described by item i of every column: sizes (size of the unnamed
+    data stream), attributes, num_links, hard_link_group_ids, the raw
+    timestamps in nanoseconds since the epoch (creation_times,
+    last_write_times, last_access_times), parents (index of the parent entry,
+    -1 for the top) and names (interned file names). hashes holds the 20 byte
+    SHA-1 of the unnamed data stream of every entry back to back.
+    """
+    def __init__(self):
+        self.sizes = array("Q")
+        self.attributes = array("I")
+        self.num_links = array("I")
+        self.hard_link_group_ids = array("Q")
+        self.creation_times = array("q")
+        self.last_write_times = array("q")
+        self.last_access_times = array("q")
+        self.parents = array("q")
+        self.names = []
+        self.hashes = bytearray()
+        self._paths = None
+
+
+    def _collector(self):
+        """ Build the wimlib_iterate_dir_tree callback filling the columns. For internal use. """
+        encoding = wimlib._backend.encoding
+        string, buffer, intern = _ffi.string, _ffi.buffer, sys.intern
+        # Index of the last entry seen at each depth, to find parents (pre-order walk).
+        # wimlib counts depths from the image root, so they are taken relative to the
+        # first entry; entries at its depth are top entries (all of them with CHILDREN).
+        last_at_depth = []
+        base_depth = None
+
+        def collect(dentry):
+            nonlocal base_depth
+            index = len(self.names)
+            if base_depth is None:
+                base_depth = dentry.depth
+            depth = dentry.depth - base_depth
+            del last_at_depth[depth:]
+            parent = last_at_depth[-1] if last_at_depth else -1
+            self.parents.append(parent)
+            last_at_depth.append(index)
+
+            # Top entries are named by their full path, the others by their file name
+            name = dentry.filename if parent >= 0 else dentry.full_path
+            name = string(name) if name != _ffi.NULL else b""
+            self.names.append(intern(name.decode(encoding) if isinstance(name, bytes) else name))
+            resource = dentry.streams[0].resource
+            self.sizes.append(resource.uncompressed_size)
+            self.hashes += buffer(resource.sha1_hash)
+            self.attributes.append(dentry.attributes)
+            self.num_links.append(dentry.num_links)
+            self.hard_link_group_ids.append(dentry.hard_link_group_id)
+            for column, timespec in ((self.creation_times, dentry.creation_time),
+                                     (self.last_write_times, dentry.last_write_time),
+                                     (self.last_access_times, dentry.last_access_time)):
+                column.append(timespec.tv_sec * 1000000000 + timespec.tv_nsec)
+            return 0
+        return collect
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    def path(self, index):
+        """ Full path of entry index in the image """
+        parts = []
+        while self.parents[index] >= 0:
+            parts.append(self.names[index])
+            index = self.parents[index]
+        if not parts:
+            return self.names[index]
+        return "/".join([self.names[index].rstrip("/")] + parts[::-1])
+
+
+    @property
+    def paths(self):
+        """ Full paths of every entry (computed once) """
+        if self._paths is None:
+            paths = []
+            for name, parent in zip(self.names, self.parents):
+                paths.append(name if parent < 0 else f"{paths[parent].rstrip('/')}/{name}")
+            self._paths = paths
+        return self._paths
+
+
+    def sha1(self, index):
+        """ SHA-1 of the unnamed data stream of entry index (20 zero bytes if none) """
+        return bytes(self.hashes[index * 20:(index + 1) * 20])
+
+
+    def is_directory(self, index):
+        return bool(self.attributes[index] & FILE_ATTRIBUTE_DIRECTORY)
+
+
+    def total_size(self):
+        """ Sum of the sizes of all entries (hard links counted once per link) """
+        return sum(self.sizes)
+
+
+    def as_numpy(self):
+        """ The columns as NumPy arrays sharing memory with this tree (requires numpy) """
+        import numpy
+        columns = {name: numpy.frombuffer(getattr(self, name), dtype=getattr(self, name).typecode)
+                   for name in ("sizes", "attributes", "num_links", "hard_link_group_ids", "creation_times",
+                                "last_write_times", "last_access_times", "parents")}
+        columns["hashes"] = numpy.frombuffer(self.hashes, dtype=numpy.uint8).reshape(-1, 20)
+        return columns
+
+
+class ExtractionPlan(object):
+    """
+    Collects path extraction requests for an image (from any number of callers
+    and threads) and runs them with the fewest wimlib_extract_paths calls: one
+    per (target, flags). Within a call libwim reads each blob once, in on-disk
+    order, so a solid chunk shared by many requested files is decompressed
+    once instead of once per extract_paths call.
+
+        plan = ExtractionPlan(image, "/tmp/drivers")
+        plan.add(["/Windows/INF/usb.inf", "/Windows/System32/drivers"])
+        plan.execute()
+
+    Duplicate paths and paths under a requested directory are dropped, and the
+    paths of each call (and the calls) are ordered by the position of their
+    data in the WIM, as found in the lookup table.
+    """
+    def __init__(self, image, target=None, flags=0):
+        self.image = image
+        self.target = target
+        self.flags = flags
+        self._requests = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def add(self, paths, target=None, flags=None):
+        """ Request paths (a path or an iterable of paths in the image) be extracted
+            to target with flags, by default those of the plan """
+        target = target if target is not None else self.target
+        if target is None:
+            raise ValueError("No extraction target.")
+        target = os.fspath(target)
+        flags = self.flags if flags is None else flags
+        if isinstance(paths, (str, bytes)):
+            paths = [paths]
+        with self._lock:
+            requested = self._requests.setdefault((target, flags), set())
+            for path in paths:
+                requested.add(path if flags & EXTRACT_FLAG_GLOB_PATHS else _normalize_wim_path(path))
+
+
+    def __len__(self):
+        return sum(len(paths) for paths in self._requests.values())
+
+
+    def calls(self):
+        """ The planned calls as (target, flags, paths) tuples, in execution order """
+        with self._lock:
+            requests = [(target, flags, list(paths)) for (target, flags), paths in self._requests.items() if paths]
+        positions = self._positions() if requests else {}
+        calls = []
+        for target, flags, paths in requests:
+            if not flags & EXTRACT_FLAG_GLOB_PATHS:
+                paths = _drop_nested(paths)
+            paths.sort(key=lambda path: (positions.get(path, _NO_POSITION), path))
+            calls.append((target, flags, paths))
+        calls.sort(key=lambda call: positions.get(call[2][0], _NO_POSITION))
+        return calls
+
+
+    def execute(self):
+        """ Run the planned calls and clear the plan, returns the number of calls made """
+        calls = self.calls()
+        for target, flags, paths in calls:
+            logging.debug(f"Extracting {len(paths)} paths of image {self.image.index} to {target}.")
+            self.image.extract_paths(target, paths, flags)
+        with self._lock:
+            self._requests.clear()
+        return len(calls)
+
+
+    def _positions(self):
+        """ (resource position, offset) of the first blob of every path of the image,
+            directories taking the first of their contents """
+        table = self.image._wim_obj.resources()
+        tree = self.image.scan_tree("/")
+        positions = [_NO_POSITION] * len(tree)
+        for i in range(len(tree)):
+            blob = table.find(tree.sha1(i))
+            if blob is not None:
+                packed = table.flags[blob] & table.FLAG_PACKED
+                positions[i] = (table.raw_resource_offsets[blob] if packed else table.offsets[blob],
+                                table.offsets[blob])
+        # Children come after their parent in the walk, so a reverse pass fills the directories
+        for i in range(len(tree) - 1, -1, -1):
+            parent = tree.parents[i]
+            if parent >= 0 and positions[i] < positions[parent]:
+                positions[parent] = positions[i]
+        return {path: position for path, position in zip(tree.paths, positions)}
+
+
+_NO_POSITION = (float("inf"), 0)
+
+
+def _normalize_wim_path(path):
+    """ Path in the image with forward slashes, a leading slash and no trailing one """
+    if isinstance(path, bytes):
+        path = path.decode(wimlib._backend.encoding)
+    path = "/" + path.replace("\\", "/").strip("/")
+    while "//" in path:
+        path = path.replace("//", "/")
+    return path
+
+
+def _drop_nested(paths):
+    """ paths without those inside another of the paths (extracted with it) """
+    paths = set(paths)
+    if "/" in paths:
+        return ["/"]
+    kept = []
+    for path in sorted(paths):
+        # Every parent is looked up: a sibling such as "/Windows.old" may sort between
+        # "/Windows" and "/Windows/INF"
+        parent = path.rpartition("/")[0]
+        while parent and parent not in paths:
+            parent = parent.rpartition("/")[0]
+        if not parent:
+            kept.append(path)
+    return kept
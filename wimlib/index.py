@@ -0,0 +1,208 @@
+"""
+Persistent sidecar index of the image metadata of a WIM file.
+
+The index is a SQLite database next to the WIM (<wim>.wimidx by default) with
+every file of every image and the lookup table. Queries never open the WIM;
+the index is rebuilt when the WIM's size, mtime or GUID no longer match.
+
+    index = WimIndex("install.wim")
+    for record in index.find("/Windows/System32/config/SYSTEM"):
+        print(record["image"], record["size"], record["sha1"].hex())
+"""
+import logging
+import os
+import sqlite3
+
+import wimlib
+from wimlib.scan import read_guid
+
+INDEX_SUFFIX = ".wimidx"
+INDEX_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE images (image INTEGER PRIMARY KEY, name TEXT, description TEXT, total_bytes INTEGER);
+CREATE TABLE files (
+    image INTEGER, path TEXT, size INTEGER, attributes INTEGER, num_links INTEGER,
+    hard_link_group_id INTEGER, creation_time INTEGER, last_write_time INTEGER,
+    last_access_time INTEGER, sha1 BLOB
+);
+CREATE TABLE resources (
+    sha1 BLOB, uncompressed_size INTEGER, compressed_size INTEGER, offset INTEGER,
+    part_number INTEGER, reference_count INTEGER, is_compressed INTEGER,
+    is_metadata INTEGER, packed INTEGER
+);
+"""
+
+# Created after the bulk insert, which is faster than maintaining them
+_INDEXES = """
+CREATE INDEX files_path ON files (path);
+CREATE INDEX files_sha1 ON files (sha1);
+CREATE INDEX resources_sha1 ON resources (sha1);
+"""
+
+_FILE_COLUMNS = ("image", "path", "size", "attributes", "num_links", "hard_link_group_id",
+                 "creation_time", "last_write_time", "last_access_time", "sha1")
+
+
+class WimIndex(object):
+    """
+    Sidecar index of a WIM file. Records are returned as dicts; timestamps are
+    in nanoseconds since the epoch and hashes are raw 20 byte SHA-1 digests.
+    With auto_rebuild, a stale or missing index is rebuilt on first query, and
+    again when the WIM file changes while the index is open.
+    """
+    def __init__(self, wim_path, index_path=None, auto_rebuild=True):
+        self.wim_path = str(wim_path)
+        self.index_path = str(index_path) if index_path else self.wim_path + INDEX_SUFFIX
+        self.auto_rebuild = auto_rebuild
+        self._db = None
+        self._db_stat = None
+
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _wim_key(self):
+        """ (size, mtime in ns, GUID) of the WIM file, what the index is checked against """
+        stat = os.stat(self.wim_path)
+        return stat.st_size, stat.st_mtime_ns, read_guid(self.wim_path)
+
+
+    def _wim_stat(self):
+        """ What tells, without reading the WIM, that it may have changed (the ctime
+            changes even when a copy restores the size and mtime) """
+        stat = os.stat(self.wim_path)
+        return stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino, stat.st_dev
+
+
+    def is_stale(self):
+        """ True if the index is missing, from another version or for another state of the WIM """
+        try:
+            db = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+        except sqlite3.Error:
+            return True
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+        except sqlite3.Error:
+            return True
+        finally:
+            db.close()
+        return (meta.get("version") != INDEX_VERSION or
+                (meta.get("wim_size"), meta.get("wim_mtime_ns"), meta.get("guid")) != self._wim_key())
+
+
+    def rebuild(self):
+        """ Build the index from the WIM, replacing any existing one """
+        from wimlib.file import WimFile
+
+        self.close()
+        logging.debug(f"Building index {self.index_path} for {self.wim_path}.")
+        wim_key = self._wim_key()
+        wim = WimFile.from_file(self.wim_path)
+        encoding = wimlib._backend.encoding
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.executescript(_SCHEMA)
+            info = wim.info
+            db.executemany("INSERT INTO meta VALUES (?, ?)", (
+                ("version", INDEX_VERSION), ("guid", wim_key[2]), ("wim_size", wim_key[0]),
+                ("wim_mtime_ns", wim_key[1]), ("boot_index", info.boot_index),
+                ("compression_type", info.compression_type[0])))
+
+            for index, image in wim.images.items():
+                db.execute("INSERT INTO images VALUES (?, ?, ?, ?)",
+                           (index, _decode(image.name, encoding), _decode(image.description, encoding), image.size))
+                tree = image.scan_tree("/")
+                db.executemany(f"INSERT INTO files VALUES ({', '.join('?' * len(_FILE_COLUMNS))})", zip(
+                    [index] * len(tree), tree.paths, tree.sizes, tree.attributes, tree.num_links,
+                    tree.hard_link_group_ids, tree.creation_times, tree.last_write_times,
+                    tree.last_access_times, (tree.sha1(i) for i in range(len(tree)))))
+
+            table = wim.resources()
+            db.executemany("INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                (table.sha1(i), table.uncompressed_sizes[i], table.compressed_sizes[i], table.offsets[i],
+                 table.part_numbers[i], table.reference_counts[i], table.flags[i] & table.FLAG_COMPRESSED,
+                 bool(table.flags[i] & table.FLAG_METADATA), bool(table.flags[i] & table.FLAG_PACKED))
+                for i in range(len(table))))
+            db.executescript(_INDEXES)
+            db.commit()
+        except:
+            db.close()
+            os.unlink(tmp_path)
+            raise
+        db.close()
+        os.replace(tmp_path, self.index_path)
+
+
+    def _connection(self):
+        if self._db is not None and self.auto_rebuild and self._wim_stat() != self._db_stat:
+            # The WIM changed since the index was opened
+            self.close()
+        if self._db is None:
+            self._db_stat = self._wim_stat()
+            if self.auto_rebuild and self.is_stale():
+                self.rebuild()
+            self._db = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+        return self._db
+
+
+    def _query(self, sql, params=()):
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+
+    @property
+    def guid(self):
+        return self._connection().execute("SELECT value FROM meta WHERE key = 'guid'").fetchone()[0]
+
+
+    def images(self):
+        """ The images (index, name, description, total_bytes) """
+        return self._query("SELECT * FROM images ORDER BY image")
+
+
+    def find(self, path):
+        """ The entries for path in every image containing it """
+        return self._query("SELECT * FROM files WHERE path = ? ORDER BY image", (path,))
+
+
+    def stat(self, path, image):
+        """ The entry for path in image, None if it does not exist """
+        records = self._query("SELECT * FROM files WHERE path = ? AND image = ?", (path, int(image)))
+        return records[0] if records else None
+
+
+    def glob(self, pattern, image=None):
+        """ The entries whose path matches the (case sensitive) glob pattern """
+        if image is None:
+            return self._query("SELECT * FROM files WHERE path GLOB ? ORDER BY image, path", (pattern,))
+        return self._query("SELECT * FROM files WHERE path GLOB ? AND image = ? ORDER BY path",
+                           (pattern, int(image)))
+
+
+    def with_sha1(self, sha1):
+        """ The entries, in any image, whose data has this SHA-1 """
+        return self._query("SELECT * FROM files WHERE sha1 = ? ORDER BY image, path", (bytes(sha1),))
+
+
+    def resource(self, sha1):
+        """ The lookup table entry for this SHA-1, None if there is none """
+        records = self._query("SELECT * FROM resources WHERE sha1 = ?", (bytes(sha1),))
+        return records[0] if records else None
+
+
+def _decode(value, encoding):
+    return value.decode(encoding) if isinstance(value, bytes) else value
@@ -1,20 +1,26 @@
-from wimlib import _ffi, compression
 import uuid
+from xml.etree import ElementTree
+
+import wimlib
 
 CHANGE_READONLY_FLAG = 0x00000001
 CHANGE_GUID = 0x00000002
 CHANGE_BOOT_INDEX = 0x00000004
 CHANGE_RPFIX_FLAG = 0x00000008
 
+# Characters of XML data fed to the parser at a time by WimXml.parse
+_XML_FEED_SIZE = 64 * 1024
+
 class WimInfo(object):
     def __init__(self, info_struct=None):
         if not info_struct:
-            self._info_struct = _ffi.new("struct wimlib_wim_info*")
+            self._info_struct = wimlib._ffi.new("struct wimlib_wim_info*")
         else:
             self._info_struct = info_struct
 
     @property
     def compression_type(self):
+        from wimlib import compression
         return (self._info_struct.compression_type, compression.get_compression_type_string(self._info_struct.compression_type))
 
     @property
@@ -34,13 +40,13 @@ class WimInfo(object):
 
     @property
     def guid(self):
-        return uuid.UUID(bytes=[chr(self._info_struct.guid[i]) for i in range(16)])
+        return uuid.UUID(bytes=bytes(self._info_struct.guid))
 
     @guid.setter
     def guid(self, value):
         if type(value) is not uuid.UUID:
             raise ValueError("GUID should be of type UUID")
-        self._info_struct.guid = value.get_bytes()
+        self._info_struct.guid = list(value.bytes)
 
     @property
     def has_integrity_table(self):
@@ -129,3 +135,58 @@ class WimInfo(object):
     def write_in_progress_flag(self):
         """ True if  the "write in progress" flag is set in this WIM's header. """
         return bool(self._info_struct.write_in_progress)
+
+
+class WimXml(object):
+    """
+    The XML data of a WIM, parsed once (WimFile.xml). properties holds the
+    top level WIM properties and images maps each image index to the
+    properties of that image. Property names are paths like the ones of
+    wimlib_get_image_property ("WINDOWS/VERSION/MAJOR", "LANGUAGES/LANGUAGE[2]")
+    and values are strings.
+    """
+    def __init__(self, properties, images):
+        self.properties = properties
+        self.images = images
+
+    @staticmethod
+    def parse(data):
+        """ Parse XML data (UTF-16 with a BOM, as stored in WIMs, or UTF-8) in one streaming pass
+            that keeps only the open elements and the properties """
+        if data[:2] in (b"\xff\xfe", b"\xfe\xff"):
+            data = data.decode("utf-16")
+        elif isinstance(data, bytes):
+            data = data.decode("utf-8")
+        parser = ElementTree.XMLPullParser(("start", "end"))
+
+        def events():
+            # Fed in pieces, the events of a piece being handled before the next one
+            for start in range(0, len(data), _XML_FEED_SIZE):
+                parser.feed(data[start:start + _XML_FEED_SIZE])
+                yield from parser.read_events()
+            parser.close()
+            yield from parser.read_events()
+
+        properties, images = {}, {}
+        # Properties of the WIM are below <WIM>, those of an image below <WIM><IMAGE>
+        target, base = properties, 1
+        # (path segment, {child tag: times seen}, element) of every open element
+        stack = []
+        for event, element in events():
+            if event == "start":
+                counts = stack[-1][1] if stack else {}
+                count = counts[element.tag] = counts.get(element.tag, 0) + 1
+                stack.append((element.tag if count == 1 else f"{element.tag}[{count}]", {}, element))
+                if len(stack) == 2 and element.tag == "IMAGE":
+                    target, base = images.setdefault(int(element.get("INDEX", len(images) + 1)), {}), 2
+                continue
+
+            segment, children, _ = stack.pop()
+            if len(stack) == 1 and element.tag == "IMAGE":
+                target, base = properties, 1
+            elif not children and len(stack) >= base:
+                target["/".join([entry[0] for entry in stack[base:]] + [segment])] = (element.text or "").strip()
+            # Only the properties are kept, not the element tree
+            if stack:
+                stack[-1][2].remove(element)
+        return WimXml(properties, images)
@@ -0,0 +1,112 @@
+"""
+Bridges between OS pipes and Python file objects, for the libwim functions
+that only take a file descriptor (pipable WIM write and extraction).
+"""
+import io
+import socket
+import threading
+
+try:
+    from ssl import SSLSocket
+except ImportError:
+    SSLSocket = ()
+
+# Size of the buffer data is moved between pipes and file objects with
+BUFFER_SIZE = 1024 * 1024
+
+
+def get_fileno(fileobj, writing=False):
+    """ The OS file descriptor libwim may use in place of fileobj, None if the data must go
+        through the methods of fileobj. Only an int, a blocking socket (not an SSL one)
+        or an unbuffered file qualify, and when writing a buffered file (which the caller
+        flushes first): other objects with a fileno(), such as HTTP responses, SSL
+        sockets, gzip files or buffered readers, hold or transform data their descriptor
+        doesn't see. """
+    if isinstance(fileobj, int):
+        return fileobj
+    if writing and isinstance(fileobj, (io.BufferedWriter, io.BufferedRandom)):
+        fileobj = fileobj.raw
+    if isinstance(fileobj, io.FileIO) or (isinstance(fileobj, socket.socket) and
+                                          not isinstance(fileobj, SSLSocket) and fileobj.gettimeout() is None):
+        try:
+            return fileobj.fileno()
+        except (OSError, ValueError):
+            return None
+    return None
+
+
+def grow(fd, size):
+    """ Raise the pipe capacity to size where supported (Linux), fewer context switches """
+    try:
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, size)
+    except (ImportError, AttributeError, OSError):
+        pass
+
+
+class _Pump(threading.Thread):
+    def __init__(self, fd, fileobj, buffer_size):
+        super(_Pump, self).__init__(name=f"wimlib-{type(self).__name__}", daemon=True)
+        self.fd = fd
+        self.fileobj = fileobj
+        self.buffer_size = buffer_size
+        self.exception = None
+
+    def run(self):
+        try:
+            self._pump()
+        except BaseException as ex:
+            self.exception = ex
+
+    def raise_pending(self):
+        """ Re-raise the exception that stopped the pump, if any """
+        if self.exception is not None:
+            raise self.exception
+
+
+def _write_all(write, view):
+    done = 0
+    while done < len(view):
+        written = write(view[done:])
+        done = len(view) if written is None else done + written
+
+
+class PipeDrain(_Pump):
+    """
+    Copies the read end of a pipe (fd, closed when done) into fileobj.write()
+    (sendall() for a socket), from one reused buffer. Closing the read end on
+    error makes the writer fail with EPIPE instead of blocking.
+    """
+    def _pump(self):
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        with open(self.fd, "rb", buffering=0) as pipe:
+            while (count := pipe.readinto(buf)):
+                if isinstance(self.fileobj, socket.socket):
+                    self.fileobj.sendall(view[:count])
+                else:
+                    _write_all(self.fileobj.write, view[:count])
+
+
+class PipeFeed(_Pump):
+    """
+    Copies fileobj (readinto() or read(), recv_into() for a socket) into the
+    write end of a pipe (fd), which is closed at the end of the data so the
+    reader sees EOF.
+    """
+    def _pump(self):
+        buf = bytearray(self.buffer_size)
+        view = memoryview(buf)
+        if isinstance(self.fileobj, socket.socket):
+            readinto = self.fileobj.recv_into
+        else:
+            readinto = getattr(self.fileobj, "readinto", None)
+        with open(self.fd, "wb", buffering=0) as pipe:
+            while True:
+                if readinto is not None:
+                    data = view[:readinto(buf) or 0]
+                else:
+                    data = self.fileobj.read(self.buffer_size)
+                if not data:
+                    break
+                _write_all(pipe.write, data)
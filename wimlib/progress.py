@@ -1,3 +1,8 @@
+import time
+import types
+
+import wimlib
+
 # Status consts - used as returns for progress callback
 PROGRESS_STATUS_CONTINUE = 0
 PROGRESS_STATUS_ABORT = 1
@@ -31,3 +36,251 @@ PROGRESS_MSG_DONE_WITH_FILE = 26
 PROGRESS_MSG_BEGIN_VERIFY_IMAGE = 27
 PROGRESS_MSG_END_VERIFY_IMAGE = 28
 PROGRESS_MSG_VERIFY_STREAMS = 29
+PROGRESS_MSG_TEST_FILE_EXCLUSION = 30
+PROGRESS_MSG_HANDLE_ERROR = 31
+
+# Status of a PROGRESS_MSG_SCAN_DENTRY event
+SCAN_DENTRY_OK = 0
+SCAN_DENTRY_EXCLUDED = 1
+SCAN_DENTRY_UNSUPPORTED = 2
+SCAN_DENTRY_FIXED_SYMLINK = 3
+SCAN_DENTRY_NOT_FIXED_SYMLINK = 4
+
+
+class _Field(object):
+    """ Descriptor reading one member of the progress info union on access. """
+    __slots__ = ("member", "field", "is_string")
+
+    def __init__(self, member, field, is_string=False):
+        self.member = member
+        self.field = field
+        self.is_string = is_string
+
+    def __get__(self, event, owner=None):
+        if event is None:
+            return self
+        value = getattr(getattr(event._info, self.member), self.field)
+        if self.is_string:
+            return _decode(value)
+        return value
+
+    def __set__(self, event, value):
+        if self.is_string:
+            raise AttributeError(f"{self.field} is read-only")
+        setattr(getattr(event._info, self.member), self.field, value)
+
+
+def _decode(value):
+    """ wimlib_tchar* to str (None for NULL) """
+    if value is None or isinstance(value, str):
+        # Already decoded (detached event)
+        return value
+    ffi = wimlib._ffi
+    if value == ffi.NULL:
+        return None
+    value = ffi.string(value)
+    return value.decode(wimlib._backend.encoding) if isinstance(value, bytes) else value
+
+
+class _DetachedInfo(object):
+    """ Stands in for the C union in detached events; every member is the decoded values. """
+    __slots__ = ("_values",)
+
+    def __init__(self, values):
+        self._values = types.SimpleNamespace(**values)
+
+    def __getattr__(self, member):
+        return self._values
+
+
+class ProgressEvent(object):
+    """
+    A progress message, passed to progress callbacks in place of the raw
+    union wimlib_progress_info*. Fields are only read from the union when
+    accessed, so the event is only valid during the callback; use as_dict()
+    to keep the values. coalesced counts the earlier events of the same
+    message dropped by rate limiting since the last delivered one.
+    """
+    __slots__ = ("msg", "coalesced", "_info")
+    _fields = ()
+
+    def __init__(self, msg, info, coalesced=0):
+        self.msg = msg
+        self.coalesced = coalesced
+        self._info = info
+
+    def __repr__(self):
+        return f"{type(self).__name__}(msg={self.msg}, {self.as_dict()})"
+
+    def as_dict(self):
+        """ Decode every field """
+        return {name: getattr(self, name) for name in self._fields}
+
+    def detach(self):
+        """ Copy of the event with every field decoded, valid after the callback returns """
+        values = {_C_FIELD_NAMES.get(name, name): getattr(self, name) for name in self._fields}
+        return type(self)(self.msg, _DetachedInfo(values), self.coalesced)
+
+
+# Event attributes named differently from the C field ("from" is a keyword)
+_C_FIELD_NAMES = {"from_path": "from", "to_path": "to"}
+
+
+def _event_class(name, member, fields, strings=()):
+    """ Build a ProgressEvent subclass for one member of the union """
+    attrs = {"__slots__": (), "_fields": tuple(fields)}
+    for field in fields:
+        attrs[field] = _Field(member, _C_FIELD_NAMES.get(field, field), field in strings)
+    return type(name, (ProgressEvent,), attrs)
+
+
+WriteStreamsEvent = _event_class("WriteStreamsEvent", "write_streams",
+    ("total_bytes", "total_streams", "completed_bytes", "completed_streams", "num_threads",
+     "compression_type", "total_parts", "completed_parts"))
+ScanEvent = _event_class("ScanEvent", "scan",
+    ("source", "cur_path", "status", "wim_target_path", "symlink_target", "num_dirs_scanned",
+     "num_nondirs_scanned", "num_bytes_scanned"),
+    strings=("source", "cur_path", "wim_target_path", "symlink_target"))
+ExtractEvent = _event_class("ExtractEvent", "extract",
+    ("image", "extract_flags", "wimfile_name", "image_name", "target", "total_bytes",
+     "completed_bytes", "total_streams", "completed_streams", "part_number", "total_parts",
+     "current_file_count", "end_file_count"),
+    strings=("wimfile_name", "image_name", "target"))
+RenameEvent = _event_class("RenameEvent", "rename", ("from_path", "to_path"), strings=("from_path", "to_path"))
+UpdateEvent = _event_class("UpdateEvent", "update", ("command", "completed_commands", "total_commands"))
+IntegrityEvent = _event_class("IntegrityEvent", "integrity",
+    ("total_bytes", "completed_bytes", "total_chunks", "completed_chunks", "chunk_size", "filename"),
+    strings=("filename",))
+SplitEvent = _event_class("SplitEvent", "split",
+    ("total_bytes", "completed_bytes", "cur_part_number", "total_parts", "part_name"),
+    strings=("part_name",))
+ReplaceEvent = _event_class("ReplaceEvent", "replace", ("path_in_wim",), strings=("path_in_wim",))
+WimbootExcludeEvent = _event_class("WimbootExcludeEvent", "wimboot_exclude",
+    ("path_in_wim", "extraction_path"), strings=("path_in_wim", "extraction_path"))
+UnmountEvent = _event_class("UnmountEvent", "unmount",
+    ("mountpoint", "mounted_wim", "mounted_image", "mount_flags", "unmount_flags"),
+    strings=("mountpoint", "mounted_wim"))
+DoneWithFileEvent = _event_class("DoneWithFileEvent", "done_with_file", ("path_to_file",),
+    strings=("path_to_file",))
+VerifyImageEvent = _event_class("VerifyImageEvent", "verify_image",
+    ("wimfile", "total_images", "current_image"), strings=("wimfile",))
+VerifyStreamsEvent = _event_class("VerifyStreamsEvent", "verify_streams",
+    ("wimfile", "total_streams", "total_bytes", "completed_streams", "completed_bytes"),
+    strings=("wimfile",))
+TestFileExclusionEvent = _event_class("TestFileExclusionEvent", "test_file_exclusion",
+    ("path", "will_exclude"), strings=("path",))
+HandleErrorEvent = _event_class("HandleErrorEvent", "handle_error",
+    ("path", "error_code", "will_ignore"), strings=("path",))
+
+
+EVENT_CLASSES = {
+    PROGRESS_MSG_EXTRACT_IMAGE_BEGIN: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_TREE_BEGIN: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_FILE_STRUCTURE: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_STREAMS: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_SPWM_PART_BEGIN: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_METADATA: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_IMAGE_END: ExtractEvent,
+    PROGRESS_MSG_EXTRACT_TREE_END: ExtractEvent,
+    PROGRESS_MSG_SCAN_BEGIN: ScanEvent,
+    PROGRESS_MSG_SCAN_DENTRY: ScanEvent,
+    PROGRESS_MSG_SCAN_END: ScanEvent,
+    PROGRESS_MSG_WRITE_STREAMS: WriteStreamsEvent,
+    PROGRESS_MSG_WRITE_METADATA_BEGIN: ProgressEvent,
+    PROGRESS_MSG_WRITE_METADATA_END: ProgressEvent,
+    PROGRESS_MSG_RENAME: RenameEvent,
+    PROGRESS_MSG_VERIFY_INTEGRITY: IntegrityEvent,
+    PROGRESS_MSG_CALC_INTEGRITY: IntegrityEvent,
+    PROGRESS_MSG_SPLIT_BEGIN_PART: SplitEvent,
+    PROGRESS_MSG_SPLIT_END_PART: SplitEvent,
+    PROGRESS_MSG_UPDATE_BEGIN_COMMAND: UpdateEvent,
+    PROGRESS_MSG_UPDATE_END_COMMAND: UpdateEvent,
+    PROGRESS_MSG_REPLACE_FILE_IN_WIM: ReplaceEvent,
+    PROGRESS_MSG_WIMBOOT_EXCLUDE: WimbootExcludeEvent,
+    PROGRESS_MSG_UNMOUNT_BEGIN: UnmountEvent,
+    PROGRESS_MSG_DONE_WITH_FILE: DoneWithFileEvent,
+    PROGRESS_MSG_BEGIN_VERIFY_IMAGE: VerifyImageEvent,
+    PROGRESS_MSG_END_VERIFY_IMAGE: VerifyImageEvent,
+    PROGRESS_MSG_VERIFY_STREAMS: VerifyStreamsEvent,
+    PROGRESS_MSG_TEST_FILE_EXCLUSION: TestFileExclusionEvent,
+    PROGRESS_MSG_HANDLE_ERROR: HandleErrorEvent,
+}
+
+def _completed(member, completed, total):
+    """ Test of the raw info: the completed field reached the total """
+    return lambda info: getattr(getattr(info, member), completed) >= getattr(getattr(info, member), total)
+
+
+# High frequency messages, the only ones subject to rate limiting: msg -> test of
+# the raw info telling an event that is always delivered (the last of a series, or
+# a scanned dentry that was not simply added)
+RATE_LIMITED_MSGS = {
+    PROGRESS_MSG_EXTRACT_FILE_STRUCTURE: _completed("extract", "current_file_count", "end_file_count"),
+    PROGRESS_MSG_EXTRACT_STREAMS: _completed("extract", "completed_bytes", "total_bytes"),
+    PROGRESS_MSG_EXTRACT_METADATA: _completed("extract", "current_file_count", "end_file_count"),
+    PROGRESS_MSG_SCAN_DENTRY: lambda info: info.scan.status != SCAN_DENTRY_OK,
+    PROGRESS_MSG_WRITE_STREAMS: _completed("write_streams", "completed_bytes", "total_bytes"),
+    PROGRESS_MSG_VERIFY_INTEGRITY: _completed("integrity", "completed_bytes", "total_bytes"),
+    PROGRESS_MSG_CALC_INTEGRITY: _completed("integrity", "completed_bytes", "total_bytes"),
+    PROGRESS_MSG_VERIFY_STREAMS: _completed("verify_streams", "completed_bytes", "total_bytes"),
+}
+
+# Messages ending a series of rate limited messages that has no final event of its
+# own; they reset the series, so the next one starts with a delivered event
+_SERIES_ENDS = {
+    PROGRESS_MSG_SCAN_END: PROGRESS_MSG_SCAN_DENTRY,
+}
+
+
+class ProgressDispatcher(object):
+    """
+    Turns wimlib progress messages into ProgressEvent objects for
+    callback(event, context). The callback may return PROGRESS_STATUS_ABORT to
+    stop the operation; if it raises, the operation is aborted and the exception
+    is re-raised by raise_pending().
+
+    max_rate limits the high frequency messages (RATE_LIMITED_MSGS) to that many
+    events per second per message type; the last event of a series (completed ==
+    total) is always delivered. SCAN_DENTRY has no last event: the totals are in
+    the SCAN_END event, and dentries that were excluded or changed are always
+    delivered.
+
+    Pass c_callback and c_context to the wimlib *_with_progress functions, and
+    keep the dispatcher alive for as long as wimlib may call it.
+    """
+    def __init__(self, callback, context=None, max_rate=None):
+        self.callback = callback
+        self.context = context
+        self.min_interval = 1.0 / max_rate if max_rate else 0
+        self.exception = None
+        self._last_time = {}
+        self._coalesced = {}
+        self.c_callback = wimlib._backend.callbacks["progress"]
+        self.c_context = wimlib._ffi.new_handle(self._dispatch)
+
+    def _dispatch(self, msg, info):
+        cls = EVENT_CLASSES.get(msg, ProgressEvent)
+        coalesced = 0
+        if self.min_interval and (must_deliver := RATE_LIMITED_MSGS.get(msg)):
+            now = time.monotonic()
+            if now - self._last_time.get(msg, 0) < self.min_interval and not must_deliver(info):
+                self._coalesced[msg] = self._coalesced.get(msg, 0) + 1
+                return PROGRESS_STATUS_CONTINUE
+            self._last_time[msg] = now
+            coalesced = self._coalesced.pop(msg, 0)
+        elif msg in _SERIES_ENDS:
+            self._last_time.pop(_SERIES_ENDS[msg], None)
+            self._coalesced.pop(_SERIES_ENDS[msg], None)
+
+        try:
+            ret_val = self.callback(cls(msg, info, coalesced), self.context)
+        except BaseException as ex:
+            self.exception = ex
+            return PROGRESS_STATUS_ABORT
+        return ret_val if ret_val is not None else PROGRESS_STATUS_CONTINUE
+
+    def raise_pending(self):
+        """ Re-raise an exception raised by the callback, if any """
+        if self.exception is not None:
+            exception, self.exception = self.exception, None
+            raise exception
@@ -0,0 +1,222 @@
+"""
+Bulk metadata scanning of many WIM files (wimlib.scan_many).
+
+Only the WIM header and the XML data are read, straight from the files:
+neither the lookup table nor any image metadata is loaded, and libwim is only
+used for the WIMs whose header can't be read that way (pipable WIMs). Records
+are yielded as the files are scanned:
+
+    for record in wimlib.scan_many(paths, workers=32, cache="wims.scancache"):
+        print(record.path, record.guid, [image.name for image in record.images])
+
+With a cache, files whose size and mtime didn't change are not read again.
+"""
+import collections
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from wimlib.info import WimXml
+
+WIM_MAGIC = b"MSWIM\0\0\0"
+PIPABLE_WIM_MAGIC = b"WLPWM\0\0\0"
+
+# Header flags
+HDR_FLAG_COMPRESSION =        0x00000002
+HDR_FLAG_COMPRESS_XPRESS =    0x00020000
+HDR_FLAG_COMPRESS_LZX =       0x00040000
+HDR_FLAG_COMPRESS_LZMS =      0x00080000
+HDR_FLAG_COMPRESS_XPRESS_2 =  0x00200000
+
+# Resource header flags
+RESHDR_FLAG_COMPRESSED =      0x04
+
+# First 124 bytes of the 208 byte header: magic, header size, version, flags, chunk size, GUID,
+# part number, total parts, image count, then the lookup table, XML data and boot metadata
+# resource headers and the boot index
+_HEADER = struct.Struct("<8sIIII16sHHI24s24s24sI")
+# Resource header: stored size (56 bits) and flags, offset, uncompressed size
+_RESHDR = struct.Struct("<QQQ")
+
+_COMPRESSION_FLAGS = ((HDR_FLAG_COMPRESS_XPRESS, 1), (HDR_FLAG_COMPRESS_LZX, 2),
+                      (HDR_FLAG_COMPRESS_LZMS, 3), (HDR_FLAG_COMPRESS_XPRESS_2, 1))
+
+WimRecord = collections.namedtuple("WimRecord", (
+    "path", "size", "mtime_ns", "guid", "wim_version", "compression_type", "chunk_size", "part_number",
+    "total_parts", "boot_index", "image_count", "total_bytes", "images", "error"))
+ImageRecord = collections.namedtuple("ImageRecord", ("index", "name", "description", "total_bytes"))
+
+
+class HeaderError(ValueError):
+    """ The WIM header or XML data can't be read without libwim """
+
+
+def _read_header(wim_file):
+    """ The header fields and the XML data of an open WIM file """
+    data = wim_file.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        raise HeaderError("File too small for a WIM header.")
+    (magic, header_size, version, flags, chunk_size, guid, part_number, total_parts, image_count,
+     _, xml_reshdr, _, boot_index) = _HEADER.unpack(data)
+    if magic != WIM_MAGIC:
+        raise HeaderError("Pipable or not a WIM file." if magic == PIPABLE_WIM_MAGIC else "Not a WIM file.")
+
+    stored_size, offset, size = _RESHDR.unpack(xml_reshdr)
+    if (stored_size >> 56) & RESHDR_FLAG_COMPRESSED:
+        raise HeaderError("Compressed XML data.")
+    wim_file.seek(offset)
+    xml_data = wim_file.read(size)
+    if len(xml_data) != size:
+        raise HeaderError("Truncated XML data.")
+
+    compression_type = 0
+    if flags & HDR_FLAG_COMPRESSION:
+        compression_type = next((ctype for flag, ctype in _COMPRESSION_FLAGS if flags & flag), 0)
+    return {"guid": str(uuid.UUID(bytes=guid)), "wim_version": version, "compression_type": compression_type,
+            "chunk_size": chunk_size, "part_number": part_number, "total_parts": total_parts,
+            "boot_index": boot_index, "image_count": image_count}, xml_data
+
+
+def read_guid(path):
+    """ GUID of the WIM file at path, read from its header (pipable WIMs included) """
+    with open(path, "rb") as wim_file:
+        data = wim_file.read(_HEADER.size)
+    if len(data) < _HEADER.size or data[:8] not in (WIM_MAGIC, PIPABLE_WIM_MAGIC):
+        raise HeaderError("Not a WIM file.")
+    return str(uuid.UUID(bytes=_HEADER.unpack(data)[5]))
+
+
+def _read_with_libwim(path):
+    """ Like _read_header, opening the WIM with libwim """
+    from wimlib.file import WimFile
+    wim = WimFile.from_file(path)
+    info = wim.info
+    return {"guid": str(info.guid), "wim_version": info.wim_version, "compression_type": info.compression_type[0],
+            "chunk_size": info.chunk_size, "part_number": info.part_number, "total_parts": info.total_parts,
+            "boot_index": info.boot_index, "image_count": info.image_count}, wim.xml_data
+
+
+def scan_file(path):
+    """ WimRecord of the WIM file at path; errors are returned in the record, not raised """
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+        try:
+            with open(path, "rb") as wim_file:
+                fields, xml_data = _read_header(wim_file)
+        except HeaderError as ex:
+            logging.debug(f"Scanning {path} with libwim: {ex}")
+            fields, xml_data = _read_with_libwim(path)
+
+        xml = WimXml.parse(xml_data)
+        images = tuple(ImageRecord(index, props.get("NAME", ""), props.get("DESCRIPTION", ""),
+                                   _int(props.get("TOTALBYTES")))
+                       for index, props in sorted(xml.images.items()))
+        return WimRecord(path, stat.st_size, stat.st_mtime_ns, total_bytes=_int(xml.properties.get("TOTALBYTES")),
+                         images=images, error=None, **fields)
+    except Exception as ex:
+        return _error_record(path, ex)
+
+
+def _error_record(path, error):
+    fields = dict.fromkeys(WimRecord._fields)
+    fields.update(path=path, images=(), error=f"{type(error).__name__}: {error}")
+    return WimRecord(**fields)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ScanCache(object):
+    """
+    SQLite cache of scan records, keyed by path, size and mtime. Safe to share
+    between threads; records with an error are not cached.
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS records "
+                         "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, record TEXT)")
+        self._lock = threading.Lock()
+
+
+    def close(self):
+        self._db.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def get(self, path, stat):
+        """ The cached record of path if the file still has the size and mtime of stat, else None """
+        with self._lock:
+            row = self._db.execute("SELECT record FROM records WHERE path = ? AND size = ? AND mtime_ns = ?",
+                                   (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is None:
+            return None
+        fields = json.loads(row[0])
+        fields["images"] = tuple(ImageRecord(*image) for image in fields["images"])
+        return WimRecord(**fields)
+
+
+    def put(self, record):
+        if record.error is not None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)",
+                             (record.path, record.size, record.mtime_ns, json.dumps(record._asdict())))
+            self._db.commit()
+
+
+def scan_many(paths, workers=None, cache=None, processes=False):
+    """ Scan WIM files concurrently, yielding a WimRecord per path as each completes.
+        workers threads (or processes with processes=True) read the files. cache is a
+        ScanCache or the path of its database; cached records of unchanged files are
+        yielded first, without reading the files. """
+    own_cache = cache is not None and not isinstance(cache, ScanCache)
+    if own_cache:
+        cache = ScanCache(cache)
+    try:
+        pending = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if cache is not None:
+                try:
+                    record = cache.get(path, os.stat(path))
+                except OSError as ex:
+                    yield _error_record(path, ex)
+                    continue
+                if record is not None:
+                    yield record
+                    continue
+            pending.append(path)
+
+        if not pending:
+            return
+        executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with executor_class(workers) as executor:
+            futures = {executor.submit(scan_file, path) for path in pending}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    if cache is not None:
+                        cache.put(record)
+                    yield record
+    finally:
+        if own_cache:
+            cache.close()
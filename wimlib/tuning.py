@@ -0,0 +1,172 @@
+"""
+Compression thread count autotuning, used by WimFile.write(threads="auto").
+
+The thread count is sized from the CPUs this process may actually use (its
+affinity mask and cgroup CPU quota) and from the output compression type. If
+calibrate() was run on the host, its measured throughput per thread count is
+used instead of the built-in heuristics.
+"""
+import json
+import logging
+import math
+import os
+import platform
+import time
+
+from wimlib import compression
+
+# Without calibration data, upper bounds on the useful thread count per codec;
+# beyond that the rest of the write path (reading, hashing, writing) dominates.
+DEFAULT_MAX_THREADS = {
+    compression.COMPRESSION_TYPE_NONE: 1,
+    compression.COMPRESSION_TYPE_XPRESS: 8,
+}
+
+# Smallest thread count reaching this fraction of the best measured throughput
+CALIBRATION_THRESHOLD = 0.95
+
+# wimlib's default chunk sizes for non-solid and solid (LZMS) resources
+_CHUNK_SIZES = {
+    compression.COMPRESSION_TYPE_XPRESS: 32768,
+    compression.COMPRESSION_TYPE_LZX: 32768,
+    compression.COMPRESSION_TYPE_LZMS: 131072,
+}
+SOLID_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def _cgroup_cpu_limit():
+    """ CPUs allowed by the cgroup (v2 or v1) CPU quota, None if unlimited or unknown """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        if quota != "max":
+            return float(quota) / float(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as quota_file, \
+                open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as period_file:
+            quota, period = int(quota_file.read()), int(period_file.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """ Number of CPUs this process may use: its affinity mask, limited by the cgroup quota """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not available on Windows and macOS
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return cpus
+
+
+def device_of(path):
+    """ st_dev of path, or of its closest existing parent if it does not exist yet """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def is_rotational(dev):
+    """ True if the block device dev (an st_dev) is a spinning disk, None if unknown (not Linux) """
+    sys_dev = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    # Partitions have no queue directory, their disk is the parent directory
+    for queue in (os.path.join(sys_dev, "queue"), os.path.join(os.path.realpath(sys_dev), "..", "queue")):
+        try:
+            with open(os.path.join(queue, "rotational")) as rotational:
+                return rotational.read().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+def _memory_limit_threads(ctype, chunk_size):
+    """ Threads whose compressors fit in half the physical memory, None if unknown """
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        per_thread = compression.get_compressor_needed_memory(ctype, chunk_size, 0)
+    except (AttributeError, ValueError, OSError):
+        return None
+    return max(1, memory // 2 // per_thread)
+
+
+def auto_threads(ctype, solid=False):
+    """ Compression thread count for writing resources compressed with ctype (solid
+        resources use LZMS with 64 MiB chunks unless ctype says otherwise) """
+    cpus = available_cpus()
+    threads = min(cpus, DEFAULT_MAX_THREADS.get(ctype, cpus))
+    measured = load_calibration().get(str(ctype))
+    if measured:
+        best = max(measured.values())
+        usable = sorted(int(count) for count, rate in measured.items()
+                        if rate >= CALIBRATION_THRESHOLD * best and int(count) <= cpus)
+        if usable:
+            threads = usable[0]
+
+    # Calibration uses small chunks; the 64 MiB chunks of solid resources need far
+    # more memory per compressor
+    if solid:
+        limit = _memory_limit_threads(ctype, SOLID_CHUNK_SIZE)
+        if limit:
+            threads = min(threads, limit)
+    return threads
+
+
+def calibration_path():
+    """ File the calibration results of this host are stored in """
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache, "python-wimlib", f"calibration-{platform.node() or 'host'}.json")
+
+
+def load_calibration():
+    """ {str(compression type): {str(threads): MB/s}} measured on this host, {} if none """
+    try:
+        with open(calibration_path()) as calibration_file:
+            data = json.load(calibration_file)
+    except (OSError, ValueError):
+        return {}
+    # Results from another CPU layout (e.g. a resized VM) don't apply
+    if data.get("cpus") != available_cpus():
+        return {}
+    return data.get("throughput", {})
+
+
+def calibrate(ctypes=(compression.COMPRESSION_TYPE_XPRESS, compression.COMPRESSION_TYPE_LZX,
+                      compression.COMPRESSION_TYPE_LZMS), thread_counts=None, data=None, size=64 * 1000 * 1000):
+    """ Measure the chunk compression throughput of each codec per thread count on this
+        host (on data, or size bytes of generated text-like data) and store it for
+        auto_threads(). Returns the results as stored. """
+    from wimlib.bench import synthetic_corpora
+
+    cpus = available_cpus()
+    if thread_counts is None:
+        thread_counts = sorted({1, 2, 4, 8, 16, 32, 64, 128, cpus} & set(range(1, cpus + 1)))
+    if data is None:
+        data = synthetic_corpora(size)["text"]
+
+    throughput = {}
+    for ctype in ctypes:
+        chunk_size = _CHUNK_SIZES[ctype]
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        rates = throughput[str(ctype)] = {}
+        for threads in thread_counts:
+            with compression.ParallelCompressor(ctype, chunk_size, 0, threads) as compressor:
+                start = time.perf_counter()
+                for _ in compressor.compress(chunks):
+                    pass
+                rates[str(threads)] = len(data) / 1e6 / (time.perf_counter() - start)
+            logging.debug(f"Calibration: type {ctype}, {threads} threads: {rates[str(threads)]:.1f} MB/s")
+
+    result = {"cpus": cpus, "time": time.time(), "throughput": throughput}
+    path = calibration_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as calibration_file:
+        json.dump(result, calibration_file, indent=2)
+    return result
@@ -0,0 +1,211 @@
+"""
+Parallel verification of many WIM files, for scheduled scrubbing of archives.
+
+    report = wimlib.verify_many(paths, workers=4, bandwidth=200e6, state="scrub.db")
+    print(report.to_json())
+
+Every WIM is opened and checked with wimlib_verify_wim on a worker thread (libwim
+releases the GIL). The bytes read by all the workers share one bandwidth budget:
+a worker is paused from its VERIFY_STREAMS progress events when it gets ahead.
+With a state database, WIMs verified successfully before and unchanged since
+(same size and mtime) are skipped.
+
+    python -m wimlib.verify [--workers N] [--bandwidth MB/s] [--state FILE] [--force] WIM...
+"""
+import argparse
+import collections
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from wimlib.progress import PROGRESS_MSG_VERIFY_STREAMS
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+VerifyResult = collections.namedtuple("VerifyResult", (
+    "path", "status", "error", "size", "mtime_ns", "bytes", "streams", "seconds", "mbs", "verified_at"))
+
+
+class BandwidthBudget(object):
+    """ Bytes per second shared by threads: consume(size) sleeps until size fits the budget """
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def consume(self, size):
+        with self._lock:
+            now = time.monotonic()
+            # Time is reserved in order; idle time is not saved up for later bursts
+            self._next = max(self._next, now) + size / self.rate
+            delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class VerifyState(object):
+    """ SQLite record of the last verification of every WIM, keyed by path, size and mtime """
+    def __init__(self, path):
+        self.path = str(path)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS verified "
+                         "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, status TEXT, "
+                         "error TEXT, verified_at REAL)")
+        self._lock = threading.Lock()
+
+
+    def close(self):
+        self._db.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def last_verified(self, path, stat):
+        """ Time of the last successful verification of path if it is unchanged since, else None """
+        with self._lock:
+            row = self._db.execute("SELECT verified_at FROM verified WHERE path = ? AND size = ? AND mtime_ns = ? "
+                                   "AND status = ?", (path, stat.st_size, stat.st_mtime_ns, STATUS_OK)).fetchone()
+        return row[0] if row else None
+
+
+    def record(self, result):
+        """ Store a VerifyResult, for the size and mtime the WIM had when it was verified """
+        if result.size is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO verified VALUES (?, ?, ?, ?, ?, ?)",
+                             (result.path, result.size, result.mtime_ns, result.status, result.error,
+                              result.verified_at))
+            self._db.commit()
+
+
+class VerifyReport(object):
+    """ Results of verify_many, one VerifyResult per WIM in the order given, and the totals """
+    def __init__(self, results, seconds):
+        self.results = results
+        self.seconds = seconds
+
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result.status == STATUS_FAILED]
+
+
+    def as_dict(self):
+        verified = [result for result in self.results if result.status != STATUS_SKIPPED]
+        total_bytes = sum(result.bytes or 0 for result in verified)
+        return {
+            "files": len(self.results),
+            "verified": len(verified),
+            "failed": len(self.failed),
+            "skipped": len(self.results) - len(verified),
+            "bytes": total_bytes,
+            "seconds": self.seconds,
+            "mbs": total_bytes / 1e6 / self.seconds if self.seconds else 0.0,
+            "results": [result._asdict() for result in self.results],
+        }
+
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+def verify_file(path, flags=0, budget=None, progress=None, context=None):
+    """ Verify the WIM at path, returns a VerifyResult (errors are reported in it, not raised).
+        Its VERIFY_STREAMS progress is charged to budget (a BandwidthBudget) if given. """
+    from wimlib.file import WimFile
+
+    read = {"bytes": 0, "streams": 0}
+
+    def on_progress(event, user_context):
+        if event.msg == PROGRESS_MSG_VERIFY_STREAMS:
+            if budget is not None:
+                budget.consume(event.completed_bytes - read["bytes"])
+            read["bytes"], read["streams"] = event.completed_bytes, event.completed_streams
+        if progress:
+            return progress(event, user_context)
+
+    start = time.perf_counter()
+    status, error, stat = STATUS_OK, None, None
+    try:
+        stat = os.stat(path)
+        WimFile.from_file(path).verify(flags, on_progress, context)
+    except Exception as ex:
+        status, error = STATUS_FAILED, f"{type(ex).__name__}: {ex}"
+    seconds = time.perf_counter() - start
+    return VerifyResult(path, status, error, stat and stat.st_size, stat and stat.st_mtime_ns, read["bytes"],
+                        read["streams"], seconds, read["bytes"] / 1e6 / seconds if seconds else 0.0, time.time())
+
+
+def verify_many(paths, workers=None, bandwidth=None, state=None, force=False, flags=0, progress=None):
+    """ Verify WIM files in parallel on workers threads and return a VerifyReport.
+        bandwidth limits the bytes per second verified by all the workers together. state is
+        a VerifyState or the path of its database: unchanged WIMs verified successfully
+        before are skipped unless force is set, and every verification is recorded.
+        progress(event, path) receives the progress events of every WIM, from the
+        worker threads. """
+    own_state = state is not None and not isinstance(state, VerifyState)
+    if own_state:
+        state = VerifyState(state)
+    budget = BandwidthBudget(bandwidth) if bandwidth else None
+    paths = [os.path.abspath(path) for path in paths]
+    results = [None] * len(paths)
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="wimlib-verify") as executor:
+            running = {}
+            for i, path in enumerate(paths):
+                if state is not None and not force:
+                    try:
+                        verified_at = state.last_verified(path, os.stat(path))
+                    except OSError:
+                        verified_at = None
+                    if verified_at is not None:
+                        results[i] = VerifyResult(path, STATUS_SKIPPED, None, None, None, None, None, None, None,
+                                                  verified_at)
+                        continue
+                running[executor.submit(verify_file, path, flags, budget, progress, path)] = i
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    results[i] = future.result()
+                    if state is not None:
+                        state.record(results[i])
+    finally:
+        if own_state:
+            state.close()
+    return VerifyReport(results, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m wimlib.verify", description="verify WIM files in parallel")
+    parser.add_argument("wims", nargs="+")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--bandwidth", type=float, default=None, help="read budget of all workers in MB/s")
+    parser.add_argument("--state", default=None, help="database of the last verifications, to skip unchanged WIMs")
+    parser.add_argument("--force", action="store_true", help="verify WIMs unchanged since their last verification")
+    args = parser.parse_args(argv)
+
+    report = verify_many(args.wims, args.workers, args.bandwidth * 1e6 if args.bandwidth else None,
+                         args.state, args.force)
+    print(report.to_json(indent=2))
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())